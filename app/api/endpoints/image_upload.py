@@ -1,13 +1,16 @@
 import os
 import uuid
 import shutil
+import asyncio
 import logging
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, BackgroundTasks
 from fastapi.responses import JSONResponse
 from typing import List, Optional
 from pydantic import BaseModel
 from pathlib import Path
 
+from app.modules.image_processing.preprocess import IMAGE_CACHE, content_digest, preprocess_image
+
 logger = logging.getLogger(__name__)
 
 # 創建路由
@@ -17,6 +20,56 @@ router = APIRouter()
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# 允許上傳的圖像副檔名
+ALLOWED_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png"})
+
+# 上傳檔案寫入設定
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 大檔案串流寫入的區塊大小
+LARGE_UPLOAD_THRESHOLD = 10 * 1024 * 1024  # 超過此大小改用串流寫入
+
+async def save_upload_file(upload: UploadFile, destination: Path) -> Optional[bytes]:
+    """
+    將上傳檔案寫入磁碟
+    
+    小檔案一次讀入後於執行緒中寫出；大小未知或超過閾值的檔案於執行緒中以64KB區塊串流寫入，
+    兩者都不阻塞事件迴圈
+    
+    返回:
+        一次讀入的檔案內容，串流寫入時返回None
+    """
+    if upload.size is not None and upload.size <= LARGE_UPLOAD_THRESHOLD:
+        data = await upload.read()
+        await asyncio.to_thread(destination.write_bytes, data)
+        return data
+    await asyncio.to_thread(_copy_upload, upload.file, destination)
+    return None
+
+def _copy_upload(source, destination: Path) -> None:
+    """以區塊串流將上傳檔案複製到磁碟（於執行緒中執行）"""
+    with open(destination, "wb") as buffer:
+        shutil.copyfileobj(source, buffer, UPLOAD_CHUNK_SIZE)
+
+def _decode_upload(data: bytes) -> Optional[tuple]:
+    """預先解碼上傳圖像，返回(內容雜湊, 預處理圖像)，無法解碼時返回None"""
+    try:
+        return content_digest(data), preprocess_image(data)
+    except Exception as e:
+        logger.warning(f"預先解碼上傳圖像失敗，將於OCR處理時由磁碟讀取: {str(e)}")
+        return None
+
+async def cache_decoded_upload(image_id: str, data: Optional[bytes]) -> None:
+    """
+    將已解碼的上傳圖像放入記憶體快取，讓緊接著的OCR處理省去讀檔與解碼
+    
+    於上傳回應送出後以背景任務執行，上傳請求不必等待解碼；OCR處理先開始或落在其他工作行程時，
+    該處理會自行由磁碟讀取，快取項目則於IMAGE_CACHE_TTL後過期
+    """
+    if data is None:
+        return
+    decoded = await asyncio.to_thread(_decode_upload, data)
+    if decoded is not None:
+        IMAGE_CACHE[image_id] = decoded
+
 class ImageUploadResponse(BaseModel):
     """圖像上傳回應模型"""
     image_ids: List[str]
@@ -26,6 +79,7 @@ class ImageUploadResponse(BaseModel):
 
 @router.post("/upload-images", response_model=ImageUploadResponse)
 async def upload_images(
+    background_tasks: BackgroundTasks,
     front_image: UploadFile = File(...),
     back_image: Optional[UploadFile] = File(None),
     batch_id: Optional[str] = Form(None)
@@ -40,19 +94,21 @@ async def upload_images(
     返回上傳圖像的IDs和批次ID
     """
     # 驗證文件類型
-    allowed_extensions = [".jpg", ".jpeg", ".png"]
     for image in [front_image, back_image] if back_image else [front_image]:
         ext = os.path.splitext(image.filename)[1].lower()
-        if ext not in allowed_extensions:
+        if ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
                 detail=f"不支援的檔案格式：{ext}。請上傳 JPG, JPEG 或 PNG 圖像。"
             )
     
     try:
+        # 一次取得批次、正面、背面三組UUID所需的隨機位元組
+        rnd = os.urandom(48)
+        
         # 如果沒有提供batch_id，則生成一個新的
         if not batch_id:
-            batch_id = str(uuid.uuid4())
+            batch_id = uuid.UUID(bytes=rnd[:16], version=4).hex
         
         # 創建此批次的目錄
         batch_dir = UPLOAD_DIR / batch_id
@@ -61,18 +117,18 @@ async def upload_images(
         image_ids = []
         
         # 保存正面圖像
-        front_id = str(uuid.uuid4())
+        front_id = uuid.UUID(bytes=rnd[16:32], version=4).hex
         front_path = batch_dir / f"{front_id}{os.path.splitext(front_image.filename)[1]}"
-        with open(front_path, "wb") as buffer:
-            shutil.copyfileobj(front_image.file, buffer)
+        front_data = await save_upload_file(front_image, front_path)
+        background_tasks.add_task(cache_decoded_upload, front_id, front_data)
         image_ids.append(front_id)
         
         # 如果有提供背面圖像，也保存它
         if back_image:
-            back_id = str(uuid.uuid4())
+            back_id = uuid.UUID(bytes=rnd[32:], version=4).hex
             back_path = batch_dir / f"{back_id}{os.path.splitext(back_image.filename)[1]}"
-            with open(back_path, "wb") as buffer:
-                shutil.copyfileobj(back_image.file, buffer)
+            back_data = await save_upload_file(back_image, back_path)
+            background_tasks.add_task(cache_decoded_upload, back_id, back_data)
             image_ids.append(back_id)
         
         logger.info(f"成功上傳了 {len(image_ids)} 張圖像，批次ID: {batch_id}")
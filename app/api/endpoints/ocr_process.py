@@ -1,19 +1,21 @@
+import asyncio
 import logging
 import os
 import shutil
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Path
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 from pydantic import BaseModel
 from pathlib import Path as PathLib
 import traceback
 import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-from app.modules.image_processing.preprocess import preprocess_image
-from app.modules.image_processing.object_detection import detect_medicine_box, detect_with_yolo_and_draw
-from app.modules.language_detection.detector import detect_language
-from app.modules.ocr.ocr_engine import perform_ocr
-from app.modules.nlp.extractor import extract_medicine_info
+from app.modules.image_processing.preprocess import IMAGE_CACHE, content_digest, preprocess_image
+from app.modules.image_processing.object_detection import detect_medicine_box_batch, save_box_image
+from app.api.endpoints.ocr_worker import init_ocr_worker, process_one, get_disk_cache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,35 @@ router = APIRouter()
 # 上傳目錄路徑
 UPLOAD_DIR = PathLib("uploads")
 
+# OCR工作行程池（行程於首次提交任務時才啟動）
+# 主行程已載入YOLO並初始化CUDA，fork出的子行程無法使用CUDA，因此以spawn啟動全新的行程
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+EXECUTOR = ProcessPoolExecutor(
+    max_workers=OCR_WORKERS,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_ocr_worker
+)
+
+def warm_up_workers() -> None:
+    """
+    預先啟動OCR工作行程，讓行程初始化時載入OCR引擎，第一個請求不必等待模型載入
+    """
+    loop = asyncio.get_running_loop()
+    for _ in range(OCR_WORKERS):
+        loop.run_in_executor(EXECUTOR, os.getpid)
+
+def shutdown_workers() -> None:
+    """關閉OCR工作行程池，取消尚未開始的任務並等待執行中的任務結束"""
+    EXECUTOR.shutdown(wait=True, cancel_futures=True)
+
+# 預處理與YOLO偵測結果快取設定（更換模型權重時遞增版本以使舊快取失效）
+PREPROC_CACHE_VERSION = "preproc_v5"
+PREPROC_CACHE_DIR = os.environ.get("PREPROC_CACHE_DIR", "cache")
+PREPROC_CACHE_SIZE_LIMIT = int(2e9)
+
+# YOLO標註圖檔名後綴（存放於批次目錄，經由 /static 提供）
+YOLO_IMAGE_SUFFIX = "_yolo.jpg"
+
 class OCRRequest(BaseModel):
     image_ids: List[str]
     batch_id: str
@@ -42,7 +73,173 @@ class OCRResponse(BaseModel):
     rawText: Optional[str] = None
     processingTime: float
 
-@router.post("/process-ocr")
+def _find_images(batch_dir: PathLib, image_ids: List[str]) -> List[tuple]:
+    """
+    找出批次目錄中各圖像ID對應的檔案
+    
+    返回:
+        (image_id, image_path)列表，找不到的圖像ID會被略過
+    """
+    # 只列出一次批次目錄，建立 {檔名主體: 路徑} 索引
+    with os.scandir(batch_dir) as entries:
+        index = {PathLib(entry.name).stem: entry.path for entry in entries if entry.is_file()}
+    
+    found = []
+    for image_id in image_ids:
+        # 尋找對應的圖像文件
+        image_path = index.get(image_id)
+        if image_path is None:
+            logger.warning(f"找不到圖像ID: {image_id}")
+            continue
+        found.append((image_id, image_path))
+    return found
+
+async def _read_images(image_paths: List[str]) -> List[bytes]:
+    """同時提交整批圖像的讀取，取代逐一開檔的阻塞讀取"""
+    return await asyncio.gather(*[asyncio.to_thread(PathLib(p).read_bytes) for p in image_paths])
+
+def _save_yolo_images(batch_dir: PathLib, batch_id: str, items: List[tuple], det_results: List[dict]) -> dict:
+    """
+    將有偵測框的圖像畫框後存入批次目錄
+    
+    返回:
+        {image_id: 靜態檔案網址}，未偵測到或儲存失敗的圖像不包含在內
+    """
+    urls = {}
+    for (image_id, _, preprocessed), det_result in zip(items, det_results):
+        if det_result["box"] is None:
+            continue
+        filename = f"{image_id}{YOLO_IMAGE_SUFFIX}"
+        if save_box_image(preprocessed, det_result["box"], batch_dir / filename):
+            urls[image_id] = f"/static/{batch_id}/{filename}"
+    return urls
+
+def _content_key(digest: str) -> str:
+    """以圖像內容雜湊值組成預處理快取鍵"""
+    return f"{PREPROC_CACHE_VERSION}:{digest}"
+
+def _prepare_batch(images: List[tuple]) -> tuple:
+    """
+    預處理整批圖像並以單次YOLO推論完成偵測
+    
+    相同內容的圖像（重新上傳或重試）直接取用快取的預處理與偵測結果
+    
+    參數:
+        images: (image_id, image_path, source)列表，source為圖像位元組，
+                或上傳時已解碼的(內容雜湊, 預處理圖像)
+    
+    返回:
+        (items, det_results, boxes)，其中items為(image_id, image_path, 預處理圖像)列表，
+        boxes為供OCR使用的裁切圖
+    """
+    cache = get_disk_cache(PREPROC_CACHE_DIR, size_limit=PREPROC_CACHE_SIZE_LIMIT)
+    keys = [
+        _content_key(content_digest(source) if isinstance(source, bytes) else source[0])
+        for _, _, source in images
+    ]
+    cached = [cache.get(key) if cache is not None else None for key in keys]
+    
+    # 1. 逐張預處理未命中快取的圖像（直接由記憶體中的位元組解碼）
+    items = []
+    for (image_id, image_path, source), hit in zip(images, cached):
+        if hit is not None:
+            logger.info(f"1. 使用快取的預處理結果: {image_id}")
+            items.append((image_id, image_path, hit[0]))
+        elif not isinstance(source, bytes):
+            logger.info(f"1. 使用上傳時已解碼的圖像: {image_id}")
+            items.append((image_id, image_path, source[1]))
+        else:
+            logger.info(f"1. 開始預處理圖像: {image_id}")
+            items.append((image_id, image_path, preprocess_image(source)))
+    
+    # 2. 未命中快取的圖像以YOLO批次偵測（整批只推論一次）
+    misses = [i for i, hit in enumerate(cached) if hit is None]
+    detected = detect_medicine_box_batch(
+        [items[i][2] for i in misses], draw=False, keys=[keys[i] for i in misses]
+    )
+    det_results = [hit[1] if hit is not None else None for hit in cached]
+    for i, det in zip(misses, detected):
+        det_results[i] = det
+        # 只保存偵測到藥盒的結果，未偵測到或推論失敗的圖像下次重新偵測
+        if cache is not None and det["box"] is not None:
+            cache.set(keys[i], (items[i][2], det))
+    
+    # 2.1 裁切圖供OCR，未偵測到時使用原圖
+    boxes = [
+        det["cropped"] if det["cropped"] is not None else preprocessed
+        for (_, _, preprocessed), det in zip(items, det_results)
+    ]
+    return items, det_results, boxes
+
+def _image_source(image_path: str) -> str:
+    """依檔名判斷圖像為藥盒正面或背面"""
+    return "front" if "_front" in image_path else "back"
+
+def _build_result(batch_id: str, item: tuple, det_result: dict, outcome: dict, yolo_url: Optional[str]) -> tuple:
+    """
+    組合單張圖像的回應內容與資料庫資料列
+    
+    返回:
+        (response_dict, db_row)
+    """
+    image_id, image_path, _ = item
+    medicine_info = outcome["medicine_info"]
+    # 構建響應
+    response = OCRResponse(
+        imageId=image_id,
+        detectedLanguage=outcome["detected_lang"],
+        medicineInfo=MedicineInfo(
+            medicineName=medicine_info.get("name"),
+            ingredients=medicine_info.get("ingredients"),
+            quantity=medicine_info.get("quantity"),
+            source=_image_source(image_path),
+            confidence=medicine_info.get("confidence", 0.0)
+        ),
+        rawText=outcome["ocr_text"],
+        processingTime=outcome["processing_time"]
+    )
+    # 8. 新增yolo畫框圖網址與資訊（只序列化一次，資料列也由此取值）
+    response_dict = response.model_dump()
+    response_dict["yolo_image_url"] = yolo_url
+    response_dict["yolo_info"] = {
+        "box": det_result["box"],
+        "confidence": det_result["confidence"],
+        "class": det_result["class"]
+    }
+    info = response_dict["medicineInfo"]
+    db_row = {
+        "image_id": image_id,
+        "batch_id": batch_id,
+        "detected_language": response_dict["detectedLanguage"],
+        "medicine_name": info["medicineName"],
+        "ingredients": info["ingredients"] or [],
+        "quantity": info["quantity"],
+        "source": info["source"],
+        "confidence": info["confidence"],
+        "raw_text": response_dict["rawText"]
+    }
+    return response_dict, db_row
+
+def _cleanup_batch(batch_dir: PathLib):
+    """若設定自動刪除，處理完後刪除該批次的上傳圖像（保留YOLO標註圖供前端讀取）"""
+    delete_uploads = os.environ.get("DELETE_UPLOADS_AFTER_PROCESS", "Y").upper()
+    if delete_uploads != "Y":
+        return
+    try:
+        if batch_dir.exists():
+            for entry in batch_dir.iterdir():
+                if not entry.name.endswith(YOLO_IMAGE_SUFFIX):
+                    if entry.is_dir():
+                        shutil.rmtree(str(entry))
+                    else:
+                        entry.unlink()
+            if not any(batch_dir.iterdir()):
+                batch_dir.rmdir()
+            logger.info(f"自動刪除批次上傳圖像: {batch_dir}")
+    except Exception as e:
+        logger.error(f"自動刪除批次上傳圖像失敗: {str(e)}")
+
+@router.post("/process-ocr", response_model=None)
 async def process_ocr(request: OCRRequest, background_tasks: BackgroundTasks):
     """
     處理上傳圖像的OCR辨識並抽取藥品資訊
@@ -50,107 +247,93 @@ async def process_ocr(request: OCRRequest, background_tasks: BackgroundTasks):
     - **image_ids**: 要處理的圖像ID列表
     - **batch_id**: 批次ID
     
-    返回OCR辨識結果和抽取的藥品資訊
+    以NDJSON串流返回結果，每張圖像完成後即輸出一行OCR辨識結果和抽取的藥品資訊
     """
+    batch_dir = UPLOAD_DIR / request.batch_id
     try:
-        batch_dir = UPLOAD_DIR / request.batch_id
-        
         if not batch_dir.exists():
             raise HTTPException(status_code=404, detail=f"找不到批次ID: {request.batch_id}")
         
-        results = []
-        
-        for image_id in request.image_ids:
-            # 尋找對應的圖像文件
-            image_files = list(batch_dir.glob(f"{image_id}.*"))
-            if not image_files:
-                logger.warning(f"找不到圖像ID: {image_id}")
-                continue
-            image_path = str(image_files[0])
-            # 1. 圖像預處理
-            logger.info(f"1. 開始預處理圖像: {image_id}")
-            preprocessed_image = preprocess_image(image_path)
-            # 2. YOLO偵測（只做一次）
-            from app.modules.image_processing.object_detection import detect_medicine_box_v2
-            det_result = detect_medicine_box_v2(preprocessed_image)
-            # 2.1 畫框圖與資訊
-            yolo_img_b64 = det_result["image_with_box"]
-            yolo_info = {
-                "box": det_result["box"],
-                "confidence": det_result["confidence"],
-                "class": det_result["class"]
-            }
-            # 2.2 裁切圖供OCR
-            detected_box = det_result["cropped"] if det_result["cropped"] is not None else preprocessed_image
-            import time
-            start_time = time.time()
-            if request.ocr_mode == 'gcp':
-                # 直接用 GCP OCR，省略步驟3~6
-                ocr_text, gcp_locale = perform_ocr(detected_box, mode='gcp')
-                detected_lang = gcp_locale or 'en'
-            else:
-                # 3. Tesseract OSD模式取得文字（僅console顯示）
-                logger.info(f"3. Tesseract OSD模式取得文字: {image_id}")
-                try:
-                    import pytesseract
-                    osd_text = pytesseract.image_to_string(detected_box, config='--psm 3')
-                    logger.info(f">>> [OSD模式文字]" + osd_text)
-                except Exception as e:
-                    logger.warning(f"[OSD模式失敗] {image_id}: {str(e)}")
-                # 4. 初步OCR以獲取語言樣本
-                logger.info(f"4. 執行初步OCR: {image_id}")
-                sample_text = perform_ocr(detected_box, "auto")
-                logger.info(f">>> " + sample_text)
-                # 5. 語言檢測
-                logger.info(f"執行語言檢測: {image_id}")
-                detected_lang = detect_language(sample_text)
-                logger.info(f">>> " + detected_lang)
-                # 6. 精確OCR處理
-                logger.info(f"使用 {detected_lang} 模型執行精確OCR: {image_id}")
-                ocr_text = perform_ocr(detected_box, detected_lang)
-            # 7. 藥品資訊抽取
-            logger.info(f"從OCR文字中抽取藥品資訊: {image_id}")
-            medicine_info = extract_medicine_info(ocr_text, detected_lang)
-            # 計算處理時間
-            processing_time = time.time() - start_time
-            # 構建響應
-            response = OCRResponse(
-                imageId=image_id,
-                detectedLanguage=detected_lang,
-                medicineInfo=MedicineInfo(
-                    medicineName=medicine_info.get("name"),
-                    ingredients=medicine_info.get("ingredients"),
-                    quantity=medicine_info.get("quantity"),
-                    source="front" if "_front" in image_path else "back",
-                    confidence=medicine_info.get("confidence", 0.0)
-                ),
-                rawText=ocr_text,
-                processingTime=processing_time
-            )
-            # 8. 新增yolo畫框圖與資訊
-            response_dict = response.dict()
-            response_dict["yolo_image_with_box"] = yolo_img_b64
-            response_dict["yolo_info"] = yolo_info
-            results.append(response_dict)
-            # 9. 背景任務儲存結果到資料庫
-            background_tasks.add_task(save_result_to_db, image_id, response.dict())
+        # 0. 優先取用上傳時已解碼的圖像，其餘一次讀入
+        found = _find_images(batch_dir, request.image_ids)
+        sources = {image_id: IMAGE_CACHE.pop(image_id, None) for image_id, _ in found}
+        to_read = [(image_id, image_path) for image_id, image_path in found if sources[image_id] is None]
+        raw_images = await _read_images([image_path for _, image_path in to_read])
+        for (image_id, _), data in zip(to_read, raw_images):
+            sources[image_id] = data
         
-        return results
-    
+        # 1~2. 預處理與YOLO偵測在執行緒中完成，避免阻塞事件迴圈
+        items, det_results, boxes = await asyncio.to_thread(
+            _prepare_batch,
+            [(image_id, image_path, sources[image_id]) for image_id, image_path in found]
+        )
+    except HTTPException:
+        _cleanup_batch(batch_dir)
+        raise
     except Exception as e:
         tb = traceback.format_exc()
         logger.error(f"處理OCR時發生錯誤: {str(e)}\n{tb}")
+        _cleanup_batch(batch_dir)
         raise HTTPException(status_code=500, detail=f"處理OCR時發生錯誤: {str(e)}\n{tb}")
-    finally:
-        # 若設定自動刪除，處理完後刪除該批次目錄
-        delete_uploads = os.environ.get("DELETE_UPLOADS_AFTER_PROCESS", "Y").upper()
-        if delete_uploads == "Y":
-            try:
-                if 'batch_dir' in locals() and batch_dir.exists():
-                    shutil.rmtree(str(batch_dir))
-                    logger.info(f"自動刪除批次目錄: {batch_dir}")
-            except Exception as e:
-                logger.error(f"自動刪除批次目錄失敗: {str(e)}")
+    
+    # 3~7. 各圖像的OCR流程分派至行程池並行處理
+    loop = asyncio.get_running_loop()
+    gcp_task = None
+    
+    async def _run(index: int) -> tuple:
+        image_id = items[index][0]
+        if gcp_task is not None:
+            # GCP模式：整批裁切圖已打包成 BatchAnnotateImages 請求，取回本張結果後只做資訊抽取
+            start_time = time.time()
+            gcp_result = (await gcp_task)[index]
+            outcome = await loop.run_in_executor(EXECUTOR, process_one, image_id, None, request.ocr_mode, gcp_result)
+            outcome["processing_time"] = time.time() - start_time
+        else:
+            outcome = await loop.run_in_executor(EXECUTOR, process_one, image_id, boxes[index], request.ocr_mode)
+        # 7.1 將YOLO畫框圖存成靜態檔案，回應中只回傳網址
+        yolo_urls = await asyncio.to_thread(
+            _save_yolo_images, batch_dir, request.batch_id, [items[index]], [det_results[index]]
+        )
+        return outcome, yolo_urls.get(image_id)
+    
+    batch_rows = []
+    
+    async def _stream():
+        nonlocal gcp_task
+        tasks = []
+        try:
+            if request.ocr_mode == 'gcp' and items:
+                from app.modules.ocr.gcp_async import ocr_batch_async
+                gcp_task = asyncio.ensure_future(ocr_batch_async(boxes))
+            # 各圖像同時處理，但依image_ids順序輸出，前端編號與資料庫寫入順序固定
+            tasks = [asyncio.ensure_future(_run(i)) for i in range(len(items))]
+            for index, task in enumerate(tasks):
+                image_id, image_path, _ = items[index]
+                try:
+                    outcome, yolo_url = await task
+                except Exception as e:
+                    logger.error(f"處理OCR時發生錯誤 ({image_id}): {str(e)}\n{traceback.format_exc()}")
+                    yield json.dumps({
+                        "imageId": image_id,
+                        "source": _image_source(image_path),
+                        "error": f"處理OCR時發生錯誤: {str(e)}"
+                    }, ensure_ascii=False) + "\n"
+                    continue
+                response_dict, db_row = _build_result(
+                    request.batch_id, items[index], det_results[index], outcome, yolo_url
+                )
+                batch_rows.append(db_row)
+                yield json.dumps(response_dict, ensure_ascii=False) + "\n"
+        finally:
+            # 用戶端中斷串流時取消尚未完成的圖像
+            for task in tasks:
+                task.cancel()
+            _cleanup_batch(batch_dir)
+    
+    # 9. 單一背景任務於串流結束後將整批結果寫入資料庫
+    if items:
+        background_tasks.add_task(save_results_to_db, batch_rows)
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
 
 @router.get("/ocr-result/{image_id}", response_model=OCRResponse)
 async def get_ocr_result(image_id: str = Path(..., description="圖像ID")):
@@ -166,11 +349,12 @@ async def get_ocr_result(image_id: str = Path(..., description="圖像ID")):
     # 這裡只是示例
     raise HTTPException(status_code=501, detail="尚未實現")
 
-async def save_result_to_db(image_id: str, result_data: dict):
-    """將結果保存到資料庫的背景任務"""
+def save_results_to_db(rows: List[dict]):
+    """將整批結果以單一交易保存到資料庫的背景任務"""
     try:
-        logger.info(f"保存圖像 {image_id} 的處理結果到資料庫")
-        # 實際實現中應該將結果存儲到資料庫
-        # 實際使用時，應引入資料庫模組並實現保存邏輯
+        from app.modules.database.db import save_ocr_results_bulk
+        
+        logger.info(f"保存 {len(rows)} 筆圖像處理結果到資料庫")
+        save_ocr_results_bulk(rows)
     except Exception as e:
-        logger.error(f"保存結果到資料庫時發生錯誤: {str(e)}") 
\ No newline at end of file
+        logger.error(f"保存結果到資料庫時發生錯誤: {str(e)}")
@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# OCR工作行程執行的處理流程。工作行程以spawn方式啟動並重新導入本模組，
+# 因此本模組不可導入YOLO/torch等只屬於主行程的依賴
+
+# 可選的磁碟快取，讓多個工作行程共用語言檢測與預處理結果
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# 工作行程啟動時預先載入的OCR語言（以逗號分隔），auto為初步OCR一定會用到的模型
+OCR_WARM_UP_LANGS = tuple(
+    lang.strip() for lang in os.environ.get("OCR_WARM_UP_LANGS", "auto").split(",") if lang.strip()
+)
+
+def init_ocr_worker():
+    """工作行程啟動時先載入常用語言的OCR引擎，之後的請求都重複使用同一個行程內的引擎"""
+    # spawn啟動的行程不會繼承主行程的日誌設定
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()]
+    )
+    from app.modules.ocr.ocr_engine import warm_up_ocr
+    warm_up_ocr(OCR_WARM_UP_LANGS)
+
+# 語言檢測快取設定
+LANG_SAMPLE_LENGTH = 512
+LANG_CACHE_VERSION = "lang_v3"  # 快取值格式或語言偵測設定變更時遞增
+# 語言信心度高於此值且初步OCR已涵蓋該語言模型時，沿用初步OCR結果
+# langdetect的機率為7次抽樣的平均（常見值為k/7），0.9約等於7次都判為同一語言；
+# 以精簡設定檔（含拉丁字母對照語言）與全部設定檔量測藥盒樣本的結果相同，門檻不需調整
+LANG_CONFIDENCE_THRESHOLD = 0.9
+LANG_CACHE_DIR = os.environ.get("LANG_CACHE_DIR", "lang_cache")
+
+# 已開啟的磁碟快取（依目錄）
+_disk_caches = {}
+
+def get_disk_cache(directory: str, **settings):
+    """
+    取得指定目錄的磁碟快取（各行程首次使用時才建立連線）
+    
+    返回:
+        diskcache.Cache，未安裝diskcache或建立失敗時返回None
+    """
+    if diskcache is None:
+        return None
+    cache = _disk_caches.get(directory)
+    if cache is None:
+        try:
+            cache = _disk_caches[directory] = diskcache.Cache(directory, **settings)
+        except Exception as e:
+            logger.warning(f"無法建立磁碟快取 {directory}: {str(e)}")
+    return cache
+
+@lru_cache(maxsize=4096)
+def _cached_detect(sample: str) -> tuple:
+    """以樣本文字為鍵快取語言檢測結果，記憶體未命中時再查詢磁碟快取"""
+    from app.modules.language_detection.detector import detect_language
+    
+    cache = get_disk_cache(LANG_CACHE_DIR)
+    if cache is None:
+        return detect_language(sample)
+    digest = hashlib.blake2b(sample.encode("utf-8"), digest_size=16).hexdigest()
+    key = f"{LANG_CACHE_VERSION}:{digest}"
+    result = cache.get(key)
+    if result is None:
+        result = detect_language(sample)
+        cache.set(key, result)
+    return tuple(result)
+
+def detect_language_cached(sample_text: str) -> tuple:
+    """取樣本文字前段進行語言檢測，相同樣本直接使用快取結果，返回(語言代碼, 信心度)"""
+    return _cached_detect(sample_text[:LANG_SAMPLE_LENGTH])
+
+def process_one(image_id: str, detected_box, ocr_mode: str, gcp_result: Optional[tuple] = None) -> dict:
+    """
+    對單張裁切圖執行語言檢測、OCR與藥品資訊抽取（於工作行程中執行）
+    
+    OCR與NLP模組在函式內導入，工作行程啟動時不需載入
+    
+    參數:
+        image_id: 圖像ID
+        detected_box: 供OCR使用的裁切圖，已提供gcp_result時可為None
+        ocr_mode: 'local' 或 'gcp'
+        gcp_result: 已由整批請求取得的 (文字, locale)，提供時不再個別呼叫 GCP
+    
+    返回:
+        包含ocr_text、detected_lang、medicine_info、processing_time的字典
+    """
+    from app.modules.ocr.ocr_engine import perform_ocr, perform_local_ocr, lang_matches_auto_model
+    from app.modules.nlp.extractor import extract_medicine_info
+    
+    start_time = time.time()
+    if ocr_mode == 'gcp':
+        # 直接用 GCP OCR，省略步驟4~6
+        ocr_text, gcp_locale = gcp_result if gcp_result is not None else perform_ocr(detected_box, mode='gcp')
+        detected_lang = gcp_locale or 'en'
+    else:
+        # 4. 初步OCR以獲取語言樣本
+        logger.info(f"4. 執行初步OCR: {image_id}")
+        sample_text, auto_engine = perform_local_ocr(detected_box, "auto")
+        logger.info(f">>> " + sample_text)
+        # 5. 語言檢測
+        logger.info(f"執行語言檢測: {image_id}")
+        detected_lang, lang_confidence = detect_language_cached(sample_text)
+        logger.info(f">>> {detected_lang} ({lang_confidence:.2f})")
+        # 6. 精確OCR處理（初步OCR已使用同一語言模型且信心度高時直接沿用）
+        if lang_confidence > LANG_CONFIDENCE_THRESHOLD and lang_matches_auto_model(detected_lang, auto_engine):
+            logger.info(f"語言信心度高且初步OCR已涵蓋 {detected_lang} 模型，沿用初步OCR結果: {image_id}")
+            ocr_text = sample_text
+        else:
+            logger.info(f"使用 {detected_lang} 模型執行精確OCR: {image_id}")
+            ocr_text = perform_ocr(detected_box, detected_lang)
+    # 7. 藥品資訊抽取
+    logger.info(f"從OCR文字中抽取藥品資訊: {image_id}")
+    medicine_info = extract_medicine_info(ocr_text, detected_lang)
+    return {
+        "ocr_text": ocr_text,
+        "detected_lang": detected_lang,
+        "medicine_info": medicine_info,
+        "processing_time": time.time() - start_time
+    }
@@ -1,15 +1,16 @@
 import streamlit as st
 import requests
 import json
-from PIL import Image, ExifTags
+from PIL import Image, ImageOps
 import io
 import os
 import time
 from typing import Dict, List, Optional, Any
-import base64
 
 # 後端API URL
 API_URL = os.environ.get("API_URL", "http://localhost:8000/api")
+# 後端根網址（靜態檔案路徑不在 /api 之下）
+API_BASE_URL = API_URL.rsplit("/api", 1)[0]
 
 # 頁面設置
 st.set_page_config(page_title="多國語藥盒OCR系統", page_icon="💊", layout="wide")
@@ -22,23 +23,78 @@ st.markdown("上傳藥盒圖像，自動識別語言、辨識文字並提取藥
 tab1, tab2, tab3 = st.tabs(["上傳圖像", "處理結果", "使用說明"])
 
 def load_and_fix_image(file):
-    image = Image.open(file)
-    try:
-        for orientation in ExifTags.TAGS.keys():
-            if ExifTags.TAGS[orientation] == 'Orientation':
-                break
-        exif = image._getexif()
-        if exif is not None:
-            orientation_value = exif.get(orientation, None)
-            if orientation_value == 3:
-                image = image.rotate(180, expand=True)
-            elif orientation_value == 6:
-                image = image.rotate(270, expand=True)
-            elif orientation_value == 8:
-                image = image.rotate(90, expand=True)
-    except Exception:
-        pass
-    return image
+    # 依EXIF方向標籤校正圖像（涵蓋全部8種方向，方向正常時不做任何處理）
+    return ImageOps.exif_transpose(Image.open(file))
+
+def render_result(i, result):
+    # 顯示單張圖像的處理結果
+    with st.expander(f"圖像 {i+1} 結果", expanded=True):
+        # 建立兩欄顯示
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            # 顯示處理的圖像
+            image_source = "正面" if result.get("medicineInfo", {}).get("source") == "front" else "背面"
+            st.markdown(f"### 藥盒{image_source}")
+
+            # 信心度指示器
+            confidence = result.get("medicineInfo", {}).get("confidence", 0)
+            st.progress(confidence, text=f"辨識信心度: {confidence:.2%}")
+
+            # 顯示語言
+            detected_lang = result.get("detectedLanguage", "未知")
+            lang_display = {
+                "zh-tw": "繁體中文", 
+                "zh-cn": "簡體中文", 
+                "en": "英文",
+                "ja": "日文",
+                "ko": "韓文"
+            }
+            st.info(f"檢測語言: {lang_display.get(detected_lang, detected_lang)}")
+
+        with col2:
+            # 顯示藥品資訊
+            st.markdown("### 藥品資訊")
+
+            medicine_info = result.get("medicineInfo", {})
+
+            # 藥品名稱
+            medicine_name = medicine_info.get("medicineName", "無法辨識")
+            st.markdown(f"**藥品名稱**: {medicine_name}")
+
+            # 藥品成分
+            ingredients = medicine_info.get("ingredients", [])
+            if ingredients:
+                st.markdown("**成分**:")
+                for ingredient in ingredients:
+                    st.markdown(f"- {ingredient}")
+            else:
+                st.markdown("**成分**: 無法辨識")
+
+            # 藥品數量
+            quantity = medicine_info.get("quantity", "無法辨識")
+            st.markdown(f"**數量**: {quantity}")
+
+            # 顯示原始OCR文字
+            with st.expander("顯示原始OCR文字"):
+                st.text(result.get("rawText", "無OCR文字"))
+
+                # 複製按鈕
+                if result.get("rawText"):
+                    if st.button("複製文字", key=f"copy_{i}"):
+                        st.code(result.get("rawText", ""), language="text")
+                        st.success("文字已複製到剪貼簿！")
+
+            # 顯示YOLO畫框圖與資訊
+            yolo_img_url = result.get("yolo_image_url")
+            yolo_info = result.get("yolo_info")
+            if yolo_img_url:
+                st.image(f"{API_BASE_URL}{yolo_img_url}", caption="YOLO標註圖", use_container_width=True)
+            else:
+                st.info("未偵測到物件或YOLO未啟用")
+            if yolo_info:
+                st.markdown("**YOLO 偵測資訊**:")
+                st.json(yolo_info)
 
 with tab1:
     st.header("上傳藥盒圖像")
@@ -128,104 +184,44 @@ with tab2:
     
     # 檢查是否有上傳的圖像
     if "image_ids" in st.session_state and st.session_state.image_ids:
-        # 顯示處理進度
+        # 串流接收處理結果，每張圖像完成後立即顯示
         if "ocr_results" not in st.session_state:
+            ocr_results = []
             with st.spinner("正在進行OCR處理..."):
                 try:
                     ocr_mode = st.session_state.get("ocr_mode", "local")
-                    process_response = requests.post(
+                    with requests.post(
                         f"{API_URL}/process-ocr",
                         json={
                             "image_ids": st.session_state.image_ids,
                             "batch_id": st.session_state.batch_id,
                             "ocr_mode": ocr_mode
-                        }
-                    )
-                    
-                    if process_response.status_code == 200:
-                        ocr_results = process_response.json()
-                        st.session_state.ocr_results = ocr_results
-                    else:
-                        st.error(f"OCR處理失敗: {process_response.text}")
+                        },
+                        stream=True
+                    ) as process_response:
+                        if process_response.status_code == 200:
+                            for line in process_response.iter_lines():
+                                if not line:
+                                    continue
+                                result = json.loads(line)
+                                if "error" in result:
+                                    image_source = "正面" if result.get("source") == "front" else "背面"
+                                    st.error(f"藥盒{image_source}（ID: {result.get('imageId')}）OCR處理失敗: {result['error']}")
+                                    continue
+                                render_result(len(ocr_results), result)
+                                ocr_results.append(result)
+                            st.session_state.ocr_results = ocr_results
+                        else:
+                            st.error(f"OCR處理失敗: {process_response.text}")
                         
                 except Exception as e:
                     st.error(f"處理出錯: {str(e)}")
+        else:
+            # 顯示處理結果
+            for i, result in enumerate(st.session_state.ocr_results):
+                render_result(i, result)
         
-        # 顯示處理結果
         if "ocr_results" in st.session_state:
-            results = st.session_state.ocr_results
-            
-            for i, result in enumerate(results):
-                with st.expander(f"圖像 {i+1} 結果", expanded=True):
-                    # 建立兩欄顯示
-                    col1, col2 = st.columns([1, 2])
-                    
-                    with col1:
-                        # 顯示處理的圖像
-                        image_source = "正面" if result.get("medicineInfo", {}).get("source") == "front" else "背面"
-                        st.markdown(f"### 藥盒{image_source}")
-                        
-                        # 信心度指示器
-                        confidence = result.get("medicineInfo", {}).get("confidence", 0)
-                        st.progress(confidence, text=f"辨識信心度: {confidence:.2%}")
-                        
-                        # 顯示語言
-                        detected_lang = result.get("detectedLanguage", "未知")
-                        lang_display = {
-                            "zh-tw": "繁體中文", 
-                            "zh-cn": "簡體中文", 
-                            "en": "英文",
-                            "ja": "日文",
-                            "ko": "韓文"
-                        }
-                        st.info(f"檢測語言: {lang_display.get(detected_lang, detected_lang)}")
-                        
-                    with col2:
-                        # 顯示藥品資訊
-                        st.markdown("### 藥品資訊")
-                        
-                        medicine_info = result.get("medicineInfo", {})
-                        
-                        # 藥品名稱
-                        medicine_name = medicine_info.get("medicineName", "無法辨識")
-                        st.markdown(f"**藥品名稱**: {medicine_name}")
-                        
-                        # 藥品成分
-                        ingredients = medicine_info.get("ingredients", [])
-                        if ingredients:
-                            st.markdown("**成分**:")
-                            for ingredient in ingredients:
-                                st.markdown(f"- {ingredient}")
-                        else:
-                            st.markdown("**成分**: 無法辨識")
-                        
-                        # 藥品數量
-                        quantity = medicine_info.get("quantity", "無法辨識")
-                        st.markdown(f"**數量**: {quantity}")
-                        
-                        # 顯示原始OCR文字
-                        with st.expander("顯示原始OCR文字"):
-                            st.text(result.get("rawText", "無OCR文字"))
-                            
-                            # 複製按鈕
-                            if result.get("rawText"):
-                                if st.button("複製文字", key=f"copy_{i}"):
-                                    st.code(result.get("rawText", ""), language="text")
-                                    st.success("文字已複製到剪貼簿！")
-                        
-                        # 顯示YOLO畫框圖與資訊
-                        yolo_img_b64 = result.get("yolo_image_with_box")
-                        yolo_info = result.get("yolo_info")
-                        if yolo_img_b64:
-                            img_bytes = base64.b64decode(yolo_img_b64)
-                            img = Image.open(io.BytesIO(img_bytes))
-                            st.image(img, caption="YOLO標註圖", use_container_width=True)
-                        else:
-                            st.info("未偵測到物件或YOLO未啟用")
-                        if yolo_info:
-                            st.markdown("**YOLO 偵測資訊**:")
-                            st.json(yolo_info)
-            
             # 提供重新開始按鈕
             if st.button("重新上傳"):
                 # 清除session_state
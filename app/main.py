@@ -1,7 +1,9 @@
 import os
+import asyncio
 import logging
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
 # 載入環境變數
@@ -15,6 +17,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 上傳目錄中的圖像與YOLO標註圖保留天數，以及清理的間隔秒數
+UPLOAD_RETENTION_DAYS = int(os.getenv("UPLOAD_RETENTION_DAYS", 1))
+UPLOAD_CLEANUP_INTERVAL = int(os.getenv("UPLOAD_CLEANUP_INTERVAL", 3600))
+_cleanup_task = None
+
 # 創建FastAPI應用
 app = FastAPI(
     title="藥盒OCR系統",
@@ -38,6 +45,50 @@ from app.api.endpoints import image_upload, ocr_process
 app.include_router(image_upload.router, prefix="/api", tags=["影像上傳"])
 app.include_router(ocr_process.router, prefix="/api", tags=["OCR處理"])
 
+# 提供上傳目錄中的YOLO標註圖
+app.mount("/static", StaticFiles(directory=str(image_upload.UPLOAD_DIR)), name="static")
+
+@app.on_event("startup")
+async def init_db():
+    """服務啟動時確保資料庫表格存在"""
+    from app.modules.database.db import create_tables
+    try:
+        create_tables()
+    except Exception as e:
+        logger.error(f"初始化資料庫失敗: {str(e)}")
+
+@app.on_event("startup")
+async def warm_up_ocr_workers():
+    """服務啟動時在背景預先啟動OCR工作行程並載入OCR引擎"""
+    try:
+        ocr_process.warm_up_workers()
+    except Exception as e:
+        logger.error(f"預先啟動OCR工作行程失敗: {str(e)}")
+
+async def _cleanup_uploads_periodically():
+    """定期刪除上傳目錄中過期的圖像與YOLO標註圖（檔案操作在執行緒中進行）"""
+    from app.utils.common import cleanup_old_files
+    while True:
+        await asyncio.to_thread(cleanup_old_files, image_upload.UPLOAD_DIR, UPLOAD_RETENTION_DAYS)
+        await asyncio.sleep(UPLOAD_CLEANUP_INTERVAL)
+
+@app.on_event("startup")
+async def start_upload_cleanup():
+    """服務啟動時排程上傳目錄的定期清理"""
+    global _cleanup_task
+    _cleanup_task = asyncio.create_task(_cleanup_uploads_periodically())
+
+@app.on_event("shutdown")
+def shutdown_ocr_workers():
+    """服務關閉時結束OCR工作行程"""
+    ocr_process.shutdown_workers()
+
+@app.on_event("shutdown")
+async def stop_upload_cleanup():
+    """服務關閉時停止定期清理"""
+    if _cleanup_task is not None:
+        _cleanup_task.cancel()
+
 @app.get("/")
 async def root():
     """健康檢查端點"""
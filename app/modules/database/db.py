@@ -1,7 +1,8 @@
 import os
 import logging
 from typing import Dict, List, Optional, Any, Union
-from sqlalchemy import create_engine, Column, String, Integer, Float, JSON, DateTime, Text, ForeignKey
+from sqlalchemy import create_engine, inspect, Column, String, Integer, Float, JSON, DateTime, Text, ForeignKey
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -12,10 +13,19 @@ logger = logging.getLogger(__name__)
 # 資料庫設定
 DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite:///medicine_ocr.db")
 
-# 初始化資料庫連接
-engine = create_engine(DB_ENGINE)
+def _engine_options(db_url: str) -> Dict[str, Any]:
+    """依資料庫類型決定連線池設定"""
+    options: Dict[str, Any] = {"pool_pre_ping": True}
+    url = make_url(db_url)
+    # SQLite記憶體資料庫使用SingletonThreadPool，不支援連線池大小設定
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        options.update(pool_size=10, max_overflow=20)
+    return options
+
+# 初始化資料庫連接（連線池共用連線，commit後不使物件過期以減少重新查詢）
+engine = create_engine(DB_ENGINE, **_engine_options(DB_ENGINE))
 Base = declarative_base()
-Session = sessionmaker(bind=engine)
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 
 class MedicineOCRResult(Base):
     """藥品OCR結果表"""
@@ -50,14 +60,43 @@ class MedicineOCRResult(Base):
 
 # 創建資料庫表格
 def create_tables():
-    """建立資料庫表格"""
+    """建立資料庫表格（表格已存在時略過DDL，避免多個工作行程重複建立）"""
     try:
+        if inspect(engine).has_table(MedicineOCRResult.__tablename__):
+            logger.info("資料庫表格已存在")
+            return
         Base.metadata.create_all(engine)
         logger.info("成功創建資料庫表格")
     except Exception as e:
         logger.error(f"創建資料庫表格失敗: {str(e)}")
         raise e
 
+def _upsert_statement(values: Union[Dict[str, Any], List[Dict[str, Any]]]):
+    """
+    建立以image_id為衝突鍵的新增或更新語句
+    
+    參數:
+        values: 單筆或多筆記錄
+        
+    返回:
+        SQLite/PostgreSQL返回INSERT ... ON CONFLICT DO UPDATE語句，其他資料庫返回None
+    """
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    
+    stmt = insert(MedicineOCRResult).values(values)
+    update_columns = {
+        column.name: stmt.excluded[column.name]
+        for column in MedicineOCRResult.__table__.columns
+        if column.name not in ("id", "image_id")
+    }
+    return stmt.on_conflict_do_update(index_elements=["image_id"], set_=update_columns)
+
 def save_ocr_result(
     image_id: str,
     batch_id: str,
@@ -86,44 +125,83 @@ def save_ocr_result(
     返回:
         保存成功返回True，否則返回False
     """
-    try:
-        session = Session()
-        
+    values = {
+        "image_id": image_id,
+        "batch_id": batch_id,
+        "detected_language": detected_language,
+        "medicine_name": medicine_name,
         # 序列化成分列表為JSON字符串
-        ingredients_json = json.dumps(ingredients, ensure_ascii=False)
-        
-        # 創建新記錄
-        ocr_result = MedicineOCRResult(
-            image_id=image_id,
-            batch_id=batch_id,
-            detected_language=detected_language,
-            medicine_name=medicine_name,
-            ingredients=ingredients_json,
-            quantity=quantity,
-            source=source,
-            confidence=confidence,
-            raw_text=raw_text
-        )
-        
-        # 如果已存在相同image_id的記錄，先刪除
-        existing = session.query(MedicineOCRResult).filter_by(image_id=image_id).first()
-        if existing:
-            session.delete(existing)
-            
-        # 添加新記錄
-        session.add(ocr_result)
-        session.commit()
+        "ingredients": json.dumps(ingredients, ensure_ascii=False),
+        "quantity": quantity,
+        "source": source,
+        "confidence": confidence,
+        "raw_text": raw_text,
+        "created_at": datetime.now()
+    }
+    
+    try:
+        # Session.begin() 於離開時自動commit，發生例外時自動rollback並關閉
+        with Session.begin() as session:
+            stmt = _upsert_statement(values)
+            if stmt is not None:
+                # 已存在相同image_id的記錄時直接覆寫，單一語句完成
+                session.execute(stmt)
+            else:
+                # 不支援upsert的資料庫：先刪除舊記錄再新增
+                session.query(MedicineOCRResult).filter_by(image_id=image_id).delete()
+                session.add(MedicineOCRResult(**values))
         
         logger.info(f"成功保存OCR結果，圖像ID: {image_id}")
         return True
         
     except Exception as e:
         logger.error(f"保存OCR結果失敗: {str(e)}")
-        session.rollback()
         return False
+
+def save_ocr_results_bulk(rows: List[Dict[str, Any]]) -> bool:
+    """
+    以單一交易批次保存多筆OCR處理結果
+    
+    參數:
+        rows: 記錄列表，欄位同save_ocr_result的參數，ingredients為成分列表
         
-    finally:
-        session.close()
+    返回:
+        保存成功返回True，否則返回False
+    """
+    if not rows:
+        return True
+    
+    now = datetime.now()
+    # 同一image_id僅保留最後一筆（PostgreSQL不允許單一upsert語句重複更新同一列）
+    values = list({
+        row["image_id"]: {
+            **row,
+            # 序列化成分列表為JSON字符串
+            "ingredients": json.dumps(row.get("ingredients") or [], ensure_ascii=False),
+            "created_at": now
+        }
+        for row in rows
+    }.values())
+    
+    try:
+        with Session.begin() as session:
+            stmt = _upsert_statement(values)
+            if stmt is not None:
+                session.execute(stmt)
+            else:
+                # 不支援upsert的資料庫：先刪除舊記錄再批次新增
+                image_ids = [value["image_id"] for value in values]
+                session.query(MedicineOCRResult).filter(
+                    MedicineOCRResult.image_id.in_(image_ids)
+                ).delete(synchronize_session=False)
+                session.bulk_insert_mappings(MedicineOCRResult, values)
+        
+        logger.info(f"成功批次保存 {len(values)} 筆OCR結果")
+        return True
+        
+    except Exception as e:
+        logger.error(f"批次保存OCR結果失敗: {str(e)}")
+        return False
 
 def get_ocr_result(image_id: str) -> Optional[Dict[str, Any]]:
     """
@@ -136,21 +214,18 @@ def get_ocr_result(image_id: str) -> Optional[Dict[str, Any]]:
         如果找到記錄，返回包含OCR結果的字典，否則返回None
     """
     try:
-        session = Session()
-        result = session.query(MedicineOCRResult).filter_by(image_id=image_id).first()
-        
-        if result:
-            return result.to_dict()
-        else:
-            logger.warning(f"找不到圖像ID: {image_id} 的OCR結果")
-            return None
+        with Session() as session:
+            result = session.query(MedicineOCRResult).filter_by(image_id=image_id).first()
+            
+            if result:
+                return result.to_dict()
+            else:
+                logger.warning(f"找不到圖像ID: {image_id} 的OCR結果")
+                return None
             
     except Exception as e:
         logger.error(f"獲取OCR結果失敗: {str(e)}")
         return None
-        
-    finally:
-        session.close()
 
 def get_batch_results(batch_id: str) -> List[Dict[str, Any]]:
     """
@@ -163,17 +238,11 @@ def get_batch_results(batch_id: str) -> List[Dict[str, Any]]:
         OCR結果列表
     """
     try:
-        session = Session()
-        results = session.query(MedicineOCRResult).filter_by(batch_id=batch_id).all()
-        
-        return [result.to_dict() for result in results]
+        with Session() as session:
+            results = session.query(MedicineOCRResult).filter_by(batch_id=batch_id).all()
+            
+            return [result.to_dict() for result in results]
             
     except Exception as e:
         logger.error(f"獲取批次結果失敗: {str(e)}")
         return []
-        
-    finally:
-        session.close()
-
-# 確保資料庫表格存在
-create_tables() 
\ No newline at end of file
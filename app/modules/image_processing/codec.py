@@ -0,0 +1,40 @@
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 嘗試使用 libjpeg-turbo (PyTurboJPEG) 進行JPEG編碼，失敗時使用OpenCV
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+    logger.info("成功啟用TurboJPEG編碼")
+except Exception as e:
+    logger.info(f"未啟用TurboJPEG，使用OpenCV編碼JPEG: {str(e)}")
+    TURBOJPEG_AVAILABLE = False
+
+# 預覽圖（YOLO畫框圖）的JPEG品質，只供顯示，不需保留OCR所需的細節
+PREVIEW_JPEG_QUALITY = 80
+
+def encode_jpeg(image: np.ndarray, quality: int = 85) -> bytes:
+    """
+    將圖像編碼為JPEG位元組
+    
+    參數:
+        image: 輸入圖像 (numpy array, BGR或灰度)
+        quality: JPEG品質
+        
+    返回:
+        JPEG位元組
+    """
+    if TURBOJPEG_AVAILABLE and image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8:
+        try:
+            return _turbo_jpeg.encode(image, quality=quality, jpeg_subsample=TJSAMP_420)
+        except Exception as e:
+            logger.warning(f"TurboJPEG編碼失敗，改用OpenCV: {str(e)}")
+    is_success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not is_success:
+        raise ValueError("無法將圖像編碼為JPEG格式")
+    return buffer.tobytes()
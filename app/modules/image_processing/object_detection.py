@@ -1,22 +1,123 @@
 import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Union
 
 import cv2
 import numpy as np
+from cachetools import LRUCache
 from ultralytics import YOLO
 import base64
 
+from app.modules.image_processing.codec import PREVIEW_JPEG_QUALITY, encode_jpeg
+from app.modules.image_processing.preprocess import to_umat, from_umat
+
+# 可選的檔案鎖，讓多個工作行程不會同時匯出TensorRT引擎（Windows沒有fcntl）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 # YOLO模型路徑
 YOLO_MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", "models/yolo/yolov9c.pt")
+# 有GPU時是否將.pt模型匯出為TensorRT引擎（FP16）使用
+YOLO_TENSORRT = os.environ.get("YOLO_TENSORRT", "Y").upper() == "Y"
+# TensorRT引擎的輸入尺寸與最大批次
+YOLO_IMGSZ = 640
+YOLO_ENGINE_BATCH = 8
+
+# 輪廓檢測前將圖像長邊縮小到此尺寸以內
+CONTOUR_MAX_SIDE = 1024
+
+# 合併同時送入的偵測請求時，最多等待的秒數
+YOLO_BATCH_WINDOW = float(os.environ.get("YOLO_BATCH_WINDOW_MS", "15")) / 1000
+
+# 偵測結果快取（以呼叫端提供的圖像內容雜湊為鍵，重複上傳或重試同一張圖時略過推論）
+DETECTION_CACHE_SIZE = 256
+_detection_cache = LRUCache(maxsize=DETECTION_CACHE_SIZE)
+_detection_cache_lock = threading.Lock()
+
+# 推論參數（信心閾值需在推論時傳入才會生效）
+YOLO_PREDICT_ARGS = {"imgsz": YOLO_IMGSZ, "conf": 0.25, "verbose": False}
+
+try:
+    import torch
+    CUDA_AVAILABLE = torch.cuda.is_available()
+    # 輸入尺寸固定為YOLO_IMGSZ，讓cuDNN挑選最快的卷積演算法
+    if CUDA_AVAILABLE:
+        torch.backends.cudnn.benchmark = True
+except ImportError:
+    torch = None
+    CUDA_AVAILABLE = False
+
+def _resolve_model_path(model_path: str) -> str:
+    """
+    有GPU時改用同目錄下的TensorRT引擎，引擎不存在則由.pt模型匯出一次
+    
+    參數:
+        model_path: YOLO模型路徑
+        
+    返回:
+        實際要載入的模型路徑，無法使用TensorRT時返回原路徑
+    """
+    if not (YOLO_TENSORRT and CUDA_AVAILABLE and model_path.endswith(".pt")):
+        return model_path
+    engine_path = str(Path(model_path).with_suffix(".engine"))
+    try:
+        # 持有鎖時才檢查引擎是否存在，其他行程會等待匯出完成，不會讀到寫到一半的引擎
+        with _export_lock(engine_path):
+            if os.path.exists(engine_path):
+                return engine_path
+            logger.info(f"匯出YOLO TensorRT引擎: {engine_path}")
+            return YOLO(model_path).export(
+                format="engine",
+                imgsz=YOLO_IMGSZ,
+                half=True,
+                dynamic=True,
+                batch=YOLO_ENGINE_BATCH,
+                workspace=4
+            )
+    except Exception as e:
+        logger.warning(f"匯出TensorRT引擎失敗: {str(e)}，使用原始模型")
+        return model_path
+
+@contextmanager
+def _export_lock(engine_path: str):
+    """
+    以引擎旁的.lock檔案序列化多個工作行程的TensorRT匯出，沒有fcntl時不加鎖
+    
+    參數:
+        engine_path: TensorRT引擎路徑
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{engine_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 # 嘗試加載YOLO模型（如果存在）
 try:
     if os.path.exists(YOLO_MODEL_PATH):
-        logger.info(f"嘗試加載YOLO模型: {YOLO_MODEL_PATH}")
-        model = YOLO('models/yolo/yolov9c.pt')
-        model.conf = 0.25  # 信心閾值
+        model_path = _resolve_model_path(YOLO_MODEL_PATH)
+        logger.info(f"嘗試加載YOLO模型: {model_path}")
+        model = YOLO(model_path)
+        if model_path.endswith(".engine"):
+            YOLO_PREDICT_ARGS.update(half=True, device=0)
+        elif CUDA_AVAILABLE and model_path.endswith(".pt"):
+            # 模型只搬到GPU一次，推論時以FP16執行
+            model.to("cuda")
+            YOLO_PREDICT_ARGS.update(half=True, device=0)
         YOLO_AVAILABLE = True
     else:
         logger.warning(f"找不到YOLO模型: {YOLO_MODEL_PATH}，將使用傳統邊緣檢測方法")
@@ -25,24 +126,20 @@ except Exception as e:
     logger.warning(f"載入YOLO模型失敗: {str(e)}，將使用傳統邊緣檢測方法")
     YOLO_AVAILABLE = False
 
-def detect_medicine_box(image: np.ndarray) -> np.ndarray:
+def _predict(source):
     """
-    從圖像中檢測藥盒區域
+    以inference_mode執行YOLO推論，不建立autograd紀錄
     
-    參數:
-        image: 輸入圖像 (numpy array)
-        
-    返回:
-        檢測到的藥盒圖像區域 (numpy array)
+    YOLO預測器不可同時被多個執行緒使用，只能由_DetectionBatcher的背景執行緒呼叫
     """
-    if YOLO_AVAILABLE:
-        return detect_with_yolo(image)
-    else:
-        return detect_with_contours(image)
+    if torch is None:
+        return model.predict(source, **YOLO_PREDICT_ARGS)
+    with torch.inference_mode():
+        return model.predict(source, **YOLO_PREDICT_ARGS)
 
 def detect_with_yolo(image: np.ndarray) -> np.ndarray:
     """
-    使用YOLO模型檢測藥盒
+    使用YOLO模型檢測藥盒（經由批次偵測執行緒推論，不直接呼叫YOLO預測器）
     
     參數:
         image: 輸入圖像 (numpy array)
@@ -50,58 +147,28 @@ def detect_with_yolo(image: np.ndarray) -> np.ndarray:
     返回:
         檢測到的藥盒圖像區域 (numpy array)
     """
-    try:
-        # 執行YOLO預測
-        results = model(image)
-        boxes = results[0].boxes if isinstance(results, list) and len(results) > 0 else None
-        if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
-            logger.warning("未檢測到藥盒，返回原始圖像")
-            return image
-        # 獲取最大可能性的檢測框（這裡預設取第一個）
-        detection = boxes.xyxy[0].cpu().numpy()
-        x1, y1, x2, y2 = map(int, detection[:4])
-        # 裁剪圖像
-        cropped = image[y1:y2, x1:x2]
-        conf = float(boxes.conf[0]) if hasattr(boxes, 'conf') else 0.0
-        logger.info(f"成功檢測到藥盒，置信度: {conf:.2f}")
-        return cropped
-    except Exception as e:
-        logger.error(f"YOLO檢測失敗: {str(e)}")
-        logger.info("轉換到備用方法")
-        return detect_with_contours(image)
+    detection = detect_medicine_box_batch([image], draw=False)[0]
+    if detection["cropped"] is None:
+        logger.warning("未檢測到藥盒，返回原始圖像")
+        return image
+    logger.info(f"成功檢測到藥盒，置信度: {detection['confidence']:.2f}")
+    return detection["cropped"]
 
 def detect_with_yolo_and_draw(image: np.ndarray) -> dict:
     """
-    使用YOLO模型檢測藥盒，並在原圖上畫框，回傳base64圖片與偵測資訊
+    使用YOLO模型檢測藥盒，並在原圖上畫框，回傳base64圖片與偵測資訊（經由批次偵測執行緒推論）
     返回: {'image_with_box': base64 str, 'info': {...}}
     """
-    if not YOLO_AVAILABLE:
-        return {"image_with_box": None, "info": None}
-    try:
-        results = model(image)
-        boxes = results[0].boxes if isinstance(results, list) and len(results) > 0 else None
-        if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
-            return {"image_with_box": None, "info": None}
-        detection = boxes.xyxy[0].cpu().numpy()
-        x1, y1, x2, y2 = map(int, detection[:4])
-        conf = float(boxes.conf[0]) if hasattr(boxes, 'conf') else 0.0
-        cls = int(boxes.cls[0]) if hasattr(boxes, 'cls') else None
-        # 畫框
-        image_with_box = image.copy()
-        cv2.rectangle(image_with_box, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        # 轉base64
-        _, buffer = cv2.imencode('.jpg', image_with_box)
-        img_b64 = base64.b64encode(buffer).decode('utf-8')
-        info = {
-            "box": [int(x1), int(y1), int(x2), int(y2)],
-            "confidence": conf,
-            "class": cls
-        }
-        logger.info(f"YOLO檢測成功")
-        return {"image_with_box": img_b64, "info": info}
-    except Exception as e:
-        logger.error(f"YOLO檢測失敗: {str(e)}")
+    detection = detect_medicine_box_batch([image])[0]
+    if detection["box"] is None:
         return {"image_with_box": None, "info": None}
+    info = {
+        "box": detection["box"],
+        "confidence": detection["confidence"],
+        "class": detection["class"]
+    }
+    logger.info(f"YOLO檢測成功")
+    return {"image_with_box": detection["image_with_box"], "info": info}
 
 def detect_with_contours(image: np.ndarray) -> np.ndarray:
     """
@@ -114,17 +181,21 @@ def detect_with_contours(image: np.ndarray) -> np.ndarray:
         檢測到的藥盒圖像區域 (numpy array)
     """
     try:
-        # 轉換到灰度圖像
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # 大圖先縮小再找輪廓，邊緣檢測的運算量隨像素數下降，外接矩形再換算回原圖座標
+        scale = min(1.0, CONTOUR_MAX_SIDE / max(image.shape[:2]))
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else image
+        
+        # 轉換到灰度圖像（灰度→模糊→邊緣整串在UMat上執行，最後才取回主記憶體）
+        gray = cv2.cvtColor(to_umat(small), cv2.COLOR_BGR2GRAY)
         
         # 高斯模糊
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # 檢測邊緣
-        edges = cv2.Canny(blurred, 50, 150)
+        edges = from_umat(cv2.Canny(blurred, 50, 150))
         
         # 查找輪廓
-        contours, _ = cv2.findContours(edges.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
         # 如果沒有找到輪廓，返回原始圖像
         if len(contours) == 0:
@@ -138,7 +209,7 @@ def detect_with_contours(image: np.ndarray) -> np.ndarray:
         x, y, w, h = cv2.boundingRect(largest_contour)
         
         # 檢查輪廓區域是否足夠大
-        image_area = image.shape[0] * image.shape[1]
+        image_area = small.shape[0] * small.shape[1]
         contour_area = w * h
         
         if contour_area < (image_area * 0.1):  # 如果輪廓太小 (小於10%的圖像面積)
@@ -146,7 +217,9 @@ def detect_with_contours(image: np.ndarray) -> np.ndarray:
             return image
             
         # 裁剪圖像
-        cropped = image[y:y+h, x:x+w]
+        x1, y1 = int(x / scale), int(y / scale)
+        x2, y2 = int(np.ceil((x + w) / scale)), int(np.ceil((y + h) / scale))
+        cropped = image[y1:y2, x1:x2]
         
         # 記錄並返回
         logger.info(f"成功檢測到藥盒輪廓，區域佔比: {contour_area/image_area:.2f}")
@@ -160,44 +233,215 @@ def get_box_image(image: np.ndarray, box: list) -> np.ndarray:
     x1, y1, x2, y2 = box
     return image[y1:y2, x1:x2]
 
-def draw_box_on_image(image: np.ndarray, box: list, color=(0,255,0), thickness=2) -> np.ndarray:
-    img = image.copy()
+def draw_box_on_image(image: np.ndarray, box: list, color=(0,255,0), thickness=2, inplace: bool = False) -> np.ndarray:
+    """
+    在圖像上畫框
+    
+    inplace為True時直接畫在傳入的圖像上（呼叫端需擁有該緩衝區），否則畫在複本上
+    """
+    img = image if inplace else image.copy()
     x1, y1, x2, y2 = box
-    import cv2
     cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
     return img
 
-def image_to_base64(image: np.ndarray) -> str:
-    import cv2, base64
-    _, buffer = cv2.imencode('.jpg', image)
-    return base64.b64encode(buffer).decode('utf-8')
+@contextmanager
+def box_drawn(image: np.ndarray, box: list, color=(0,255,0), thickness=2):
+    """
+    暫時在圖像上畫框，離開時還原框線經過的像素
+    
+    只備份四條框線附近的像素帶，避免為了編碼預覽圖而複製整張圖像；
+    期間其他執行緒不可讀取此圖像（包含由它切出的裁切圖）
+    """
+    x1, y1, x2, y2 = box
+    left, top = max(x1 - thickness, 0), max(y1 - thickness, 0)
+    right, bottom = x2 + thickness + 1, y2 + thickness + 1
+    bands = [
+        (slice(top, y1 + thickness + 1), slice(left, right)),
+        (slice(max(y2 - thickness, 0), bottom), slice(left, right)),
+        (slice(top, bottom), slice(left, x1 + thickness + 1)),
+        (slice(top, bottom), slice(max(x2 - thickness, 0), right)),
+    ]
+    saved = [(band, image[band].copy()) for band in bands]
+    try:
+        yield draw_box_on_image(image, box, color, thickness, inplace=True)
+    finally:
+        for band, pixels in saved:
+            image[band] = pixels
+
+def image_to_base64(image: np.ndarray, quality: int = PREVIEW_JPEG_QUALITY) -> str:
+    return base64.b64encode(encode_jpeg(image, quality=quality)).decode('ascii')
+
+def _empty_detection() -> dict:
+    return {"box": None, "confidence": None, "class": None, "cropped": None, "image_with_box": None}
+
+def _detection_from_box(image: np.ndarray, box: list, conf: float, cls, draw: bool = True) -> dict:
+    """以偵測框在圖像上裁切，必要時產生畫框圖（base64）"""
+    cropped = get_box_image(image, box)
+    img_b64 = None
+    if draw:
+        with box_drawn(image, box) as image_with_box:
+            img_b64 = image_to_base64(image_with_box)
+    return {
+        "box": box,
+        "confidence": conf,
+        "class": cls,
+        "cropped": cropped,
+        "image_with_box": img_b64
+    }
+
+def _build_detection(image: np.ndarray, result, draw: bool = True) -> dict:
+    """
+    將單張圖像的YOLO結果整理為box、confidence、class、裁切圖、畫框圖（base64）
+    
+    draw為False時不產生畫框圖，image_with_box為None
+    """
+    boxes = result.boxes if result is not None else None
+    if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
+        return _empty_detection()
+    # 只把第一個框的4個整數座標傳回主機，不複製整個張量
+    x1, y1, x2, y2 = boxes.xyxy[0, :4].int().tolist()
+    conf = float(boxes.conf[0]) if hasattr(boxes, 'conf') else 0.0
+    cls = int(boxes.cls[0]) if hasattr(boxes, 'cls') else None
+    return _detection_from_box(image, [int(x1), int(y1), int(x2), int(y2)], conf, cls, draw)
+
+def save_box_image(image: np.ndarray, box: list, path: Union[str, Path], quality: int = PREVIEW_JPEG_QUALITY) -> bool:
+    """
+    在圖像上畫框並另存為JPEG檔，供靜態檔案路徑直接提供
+    
+    參數:
+        image: 輸入圖像 (numpy array)
+        box: 偵測框 [x1, y1, x2, y2]
+        path: 輸出檔案路徑
+        quality: JPEG品質
+        
+    返回:
+        寫入成功返回True，否則返回False
+    """
+    try:
+        with box_drawn(image, box) as image_with_box:
+            data = encode_jpeg(image_with_box, quality=quality)
+        Path(path).write_bytes(data)
+        return True
+    except Exception as e:
+        logger.error(f"儲存YOLO標註圖失敗: {str(e)}")
+        return False
 
 def detect_medicine_box_v2(image: np.ndarray) -> dict:
     """
     只偵測一次，回傳box、confidence、class、裁切圖、畫框圖（base64）
     """
+    return detect_medicine_box_batch([image])[0]
+
+class _DetectionBatcher:
+    """
+    將各請求送入的圖像合併為單次YOLO批次推論
+    
+    背景執行緒收到第一張圖像後，在時間窗內再收集其他請求的圖像，
+    湊滿max_batch張或時間到即一起推論，再把結果分送回各請求的Future
+    """
+    def __init__(self, max_batch: int, window: float):
+        self._queue = queue.Queue()
+        self._max_batch = max_batch
+        self._window = window
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, image: np.ndarray, draw: bool) -> Future:
+        """送入一張圖像，返回偵測結果的Future"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((image, draw, future))
+        return future
+    
+    def _collect(self) -> list:
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self._window
+        while len(pending) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
+    
+    def _run(self):
+        while True:
+            pending = self._collect()
+            images = [image for image, _, _ in pending]
+            try:
+                results = _predict(images)
+                if not isinstance(results, list) or len(results) != len(images):
+                    raise ValueError("YOLO回傳的結果數量與圖像數量不一致")
+                detections = [
+                    _build_detection(image, result, draw)
+                    for (image, draw, _), result in zip(pending, results)
+                ]
+            except Exception as e:
+                logger.error(f"YOLO批次檢測失敗: {str(e)}")
+                for _, _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), detection in zip(pending, detections):
+                future.set_result(detection)
+
+_batcher = _DetectionBatcher(YOLO_ENGINE_BATCH, YOLO_BATCH_WINDOW)
+
+def detect_medicine_box_batch(
+    images: List[np.ndarray],
+    draw: bool = True,
+    keys: Optional[List[str]] = None
+) -> List[dict]:
+    """
+    批次偵測多張圖像，每張圖像回傳與detect_medicine_box_v2相同格式的結果
+    
+    同時進行的請求會被合併為同一次YOLO推論（每批最多YOLO_ENGINE_BATCH張）
+    
+    參數:
+        images: 輸入圖像列表 (numpy array)
+        draw: 是否產生base64畫框圖
+        keys: 與images等長的內容快取鍵（如上傳檔案的內容雜湊），提供時才使用偵測結果快取，
+              不在此重新雜湊整張圖像
+        
+    返回:
+        與images順序相同的偵測結果列表
+    """
+    if not images:
+        return []
     if not YOLO_AVAILABLE:
-        return {"box": None, "confidence": None, "class": None, "cropped": None, "image_with_box": None}
-    try:
-        results = model(image)
-        boxes = results[0].boxes if isinstance(results, list) and len(results) > 0 else None
-        if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
-            return {"box": None, "confidence": None, "class": None, "cropped": None, "image_with_box": None}
-        detection = boxes.xyxy[0].cpu().numpy()
-        x1, y1, x2, y2 = map(int, detection[:4])
-        conf = float(boxes.conf[0]) if hasattr(boxes, 'conf') else 0.0
-        cls = int(boxes.cls[0]) if hasattr(boxes, 'cls') else None
-        box = [int(x1), int(y1), int(x2), int(y2)]
-        cropped = get_box_image(image, box)
-        image_with_box = draw_box_on_image(image, box)
-        img_b64 = image_to_base64(image_with_box)
-        return {
-            "box": box,
-            "confidence": conf,
-            "class": cls,
-            "cropped": cropped,
-            "image_with_box": img_b64
-        }
-    except Exception as e:
-        logger.error(f"YOLO檢測失敗: {str(e)}")
-        return {"box": None, "confidence": None, "class": None, "cropped": None, "image_with_box": None} 
\ No newline at end of file
+        return [_empty_detection() for _ in images]
+    # 快取只保存偵測框，命中時仍以目前的圖像重新裁切與畫框
+    if keys is None:
+        keys = [None] * len(images)
+    with _detection_cache_lock:
+        cached = [_detection_cache.get(key) if key is not None else None for key in keys]
+    futures = {
+        i: _batcher.submit(image, draw)
+        for i, (image, hit) in enumerate(zip(images, cached)) if hit is None
+    }
+    detections = []
+    for i, (image, key, hit) in enumerate(zip(images, keys, cached)):
+        if hit is not None:
+            logger.info("使用快取的YOLO偵測結果")
+            detections.append(_empty_detection() if hit[0] is None else _detection_from_box(image, *hit, draw))
+            continue
+        try:
+            detection = futures[i].result()
+        except Exception:
+            # 推論失敗（如暫時性的CUDA錯誤）不寫入快取，下次請求會重新推論
+            detections.append(_empty_detection())
+            continue
+        if key is not None:
+            with _detection_cache_lock:
+                _detection_cache[key] = (detection["box"], detection["confidence"], detection["class"])
+        detections.append(detection)
+    return detections
+
+
+# YOLO_AVAILABLE在行程內不會改變，於匯入時直接綁定入口函數，避免每次呼叫都判斷分支
+detect_medicine_box = detect_with_yolo if YOLO_AVAILABLE else detect_with_contours
@@ -1,48 +1,100 @@
+import io
+import hashlib
 import cv2
 import numpy as np
 import logging
 from pathlib import Path
 from typing import Union, Optional, Tuple
-from PIL import Image, ExifTags
+from PIL import Image
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
-def load_image_with_exif(path):
-    image = Image.open(path)
+# 上傳後短時間內保留已解碼的預處理圖像，供OCR處理直接取用（依圖像位元組數限制總量）
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGE_CACHE_TTL = 300  # 秒
+IMAGE_CACHE = TTLCache(maxsize=IMAGE_CACHE_MAX_BYTES, ttl=IMAGE_CACHE_TTL, getsizeof=lambda entry: entry[1].nbytes)
+
+# 有可用的OpenCL裝置時，經由OpenCV T-API (UMat) 把連續的影像運算留在裝置上執行
+USE_OPENCL = cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
+
+def to_umat(image: np.ndarray):
+    """OpenCL可用時將圖像包裝為UMat，否則原樣返回"""
+    return cv2.UMat(image) if USE_OPENCL else image
+
+def from_umat(image) -> np.ndarray:
+    """將UMat結果取回為numpy array"""
+    return image.get() if isinstance(image, cv2.UMat) else image
+
+def content_digest(data: bytes) -> str:
+    """計算圖像原始位元組的雜湊值，作為內容快取的鍵"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# EXIF方向標籤 (0x0112)
+ORIENTATION_TAG = 274
+
+# EXIF方向值對應的校正操作（與PIL ImageOps.exif_transpose一致）
+_ORIENTATION_TRANSFORMS = {
+    2: lambda img: cv2.flip(img, 1),
+    3: lambda img: cv2.rotate(img, cv2.ROTATE_180),
+    4: lambda img: cv2.flip(img, 0),
+    5: lambda img: cv2.transpose(img),
+    6: lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE),
+    7: lambda img: cv2.flip(cv2.transpose(img), -1),
+    8: lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE),
+}
+
+def _read_orientation(source) -> int:
+    """只解析檔頭讀取EXIF方向值（不解碼像素），讀取失敗時視為正常方向"""
     try:
-        for orientation in ExifTags.TAGS.keys():
-            if ExifTags.TAGS[orientation] == 'Orientation':
-                break
-        exif = image._getexif()
-        if exif is not None:
-            orientation_value = exif.get(orientation, None)
-            if orientation_value == 3:
-                image = image.rotate(180, expand=True)
-            elif orientation_value == 6:
-                image = image.rotate(270, expand=True)
-            elif orientation_value == 8:
-                image = image.rotate(90, expand=True)
+        with Image.open(source) as image:
+            return image.getexif().get(ORIENTATION_TAG, 1)
     except Exception:
-        pass
-    return np.array(image)
+        return 1
+
+def load_image_with_exif(path) -> Optional[np.ndarray]:
+    """
+    以OpenCV直接解碼為BGR圖像，並依EXIF方向標籤校正
+    
+    參數:
+        path: 圖像文件路徑，或已讀取的圖像位元組
+        
+    返回:
+        BGR圖像 (numpy array)，無法解碼時返回None
+    """
+    if isinstance(path, bytes):
+        image = cv2.imdecode(np.frombuffer(path, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        source = io.BytesIO(path)
+    else:
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        source = path
+    if image is None:
+        return None
+    transform = _ORIENTATION_TRANSFORMS.get(_read_orientation(source))
+    return transform(image) if transform is not None else image
 
-def preprocess_image(image_path: Union[str, Path], resize_dim: Optional[Tuple[int, int]] = None) -> np.ndarray:
+def preprocess_image(image_path: Union[str, Path, bytes], resize_dim: Optional[Tuple[int, int]] = None) -> np.ndarray:
     """
     預處理藥盒圖像以準備OCR
     
     參數:
-        image_path: 圖像文件路徑
+        image_path: 圖像文件路徑，或已讀取的圖像位元組
         resize_dim: 可選的調整大小尺寸 (width, height)
         
     返回:
         預處理後的圖像 (numpy array)
     """
+    if isinstance(image_path, bytes):
+        image_source = image_path
+        image_path = f"<{len(image_source)} bytes>"
+    else:
+        image_source = str(image_path)
     logger.info(f"開始預處理圖像: {image_path}")
     
     try:
         # 讀取圖像（自動校正EXIF方向）
-        image = load_image_with_exif(str(image_path))
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)  # PIL為RGB, OpenCV為BGR
+        image = load_image_with_exif(image_source)
         if image is None:
             raise ValueError(f"無法讀取圖像: {image_path}")
         
@@ -50,60 +102,10 @@ def preprocess_image(image_path: Union[str, Path], resize_dim: Optional[Tuple[in
         if resize_dim is not None:
             image = cv2.resize(image, resize_dim, interpolation=cv2.INTER_AREA)
         
-        # 轉換為灰度圖像以進行處理
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # 應用高斯模糊以減少噪聲
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        
-        # 應用自適應閾值處理以處理不同照明條件
-        thresh = cv2.adaptiveThreshold(
-            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-        )
-        
-        # 應用形態學運算以清理雜訊
-        kernel = np.ones((3, 3), np.uint8)
-        opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
-        
-        # 返回原始彩色圖像和處理後的二值圖像
+        # 返回原始彩色圖像（物件偵測與RapidOCR都使用彩色圖像，Tesseract的灰度輸入由prepare_tesseract_input產生）
         logger.info(f"圖像預處理完成: {image_path}")
-        return image  # 返回原始圖像，進行物件偵測時會用到彩色圖像
+        return image
         
     except Exception as e:
         logger.error(f"圖像預處理失敗: {str(e)}")
         raise e
-
-def enhance_image_for_ocr(image: np.ndarray) -> np.ndarray:
-    """
-    專為OCR優化圖像
-    
-    參數:
-        image: 輸入圖像 (numpy array)
-        
-    返回:
-        增強後的圖像 (numpy array)
-    """
-    try:
-        # 轉換為灰度
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = image
-            
-        # 應用CLAHE (限制性對比度自適應直方圖均衡) 增強對比度
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        # 雙向濾波來保留邊緣同時消除噪聲
-        filtered = cv2.bilateralFilter(enhanced, 9, 75, 75)
-        
-        # 應用自適應閾值
-        thresh = cv2.adaptiveThreshold(
-            filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
-        )
-        
-        return thresh
-        
-    except Exception as e:
-        logger.error(f"OCR圖像增強失敗: {str(e)}")
-        raise e 
\ No newline at end of file
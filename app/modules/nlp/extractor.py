@@ -48,6 +48,68 @@ UNIT_PATTERNS = {
     'ko': r'(\d+(?:\.\d+)?\s*(?:정|캡슐|알|팩|병|개|조각|제))'
 }
 
+def _keyword_regex(keywords, flags=0):
+    """將關鍵字列表編譯成單一交替式正規表達式（長關鍵字優先）"""
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    return re.compile("|".join(re.escape(kw) for kw in ordered), flags)
+
+# 預先編譯的正規表達式（模組載入時建立一次，每次抽取直接重用）
+DOSE_REGEX = {lang: re.compile(pattern) for lang, pattern in DOSE_PATTERNS.items()}
+UNIT_REGEX = {lang: re.compile(pattern) for lang, pattern in UNIT_PATTERNS.items()}
+
+def _keyword_categories() -> Dict[str, Dict[str, Set[str]]]:
+    """整理各語言關鍵詞所屬的類別 {語言: {關鍵詞: {'name', 'ingredient', 'quantity'}}}"""
+    result = {}
+    for category, keywords in (('name', MEDICINE_NAME_KEYWORDS), ('ingredient', INGREDIENT_KEYWORDS), ('quantity', QUANTITY_KEYWORDS)):
+        for lang, kws in keywords.items():
+            for kw in kws:
+                result.setdefault(lang, {}).setdefault(kw, set()).add(category)
+    return result
+
+KEYWORD_CATEGORIES = _keyword_categories()
+# 全部區段關鍵字（比對前文本已轉為小寫）
+ALL_KEYWORDS = {lang: set(categories) for lang, categories in KEYWORD_CATEGORIES.items()}
+ALL_KEYWORD_REGEX = {lang: _keyword_regex(kw.lower() for kw in kws) for lang, kws in ALL_KEYWORDS.items()}
+
+_WHITESPACE_REGEX = re.compile(r'\s+')
+_COLON_REGEX = re.compile(r'[:：]')
+_PUNCTUATION_REGEX = re.compile(r'[^\w\s]')
+_UNIT_ONLY_LINE_REGEX = re.compile(r'^\d+\s*(錠|粒|包|瓶|支|片|劑)$')
+
+# 嘗試使用Aho-Corasick自動機，每行只掃描一次即找出所有關鍵詞
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+def _build_automaton(keywords):
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATA = (
+    {lang: _build_automaton(keywords) for lang, keywords in ALL_KEYWORDS.items()}
+    if AHOCORASICK_AVAILABLE else {}
+)
+
+def line_keywords(line: str, lang: str) -> Set[str]:
+    """找出行中出現的所有關鍵詞（未安裝pyahocorasick時逐一比對）"""
+    automaton = KEYWORD_AUTOMATA.get(lang)
+    if automaton is None:
+        return {keyword for keyword in ALL_KEYWORDS[lang] if keyword in line}
+    return {keyword for _, keyword in automaton.iter(line)}
+
+def line_categories(line: str, lang: str) -> Set[str]:
+    """返回行中出現的關鍵詞類別（name、ingredient、quantity）"""
+    categories = KEYWORD_CATEGORIES[lang]
+    found = set()
+    for keyword in line_keywords(line, lang):
+        found |= categories[keyword]
+    return found
+
 # 嘗試載入進階NLP模型(如果有)
 try:
     # 這裡可以嘗試載入如spaCy、HuggingFace模型等
@@ -76,14 +138,8 @@ def extract_medicine_info(text: str, lang: str) -> Dict[str, Any]:
         logger.warning(f"不支援的語言: {lang}，使用英文作為預設")
         lang = 'en'
     
-    # 抽取藥品名稱
-    medicine_name = extract_medicine_name(text, lang)
-    
-    # 抽取成分
-    ingredients = extract_ingredients(text, lang)
-    
-    # 抽取數量
-    quantity = extract_quantity(text, lang)
+    # 單次走訪文本，同時抽取藥品名稱、成分、數量
+    medicine_name, ingredients, quantity = _single_pass_extract(text, lang)
     
     # 計算整體置信度
     confidence = calculate_confidence(medicine_name, ingredients, quantity)
@@ -98,177 +154,144 @@ def extract_medicine_info(text: str, lang: str) -> Dict[str, Any]:
     logger.info(f"抽取結果: {result}")
     return result
 
-def extract_medicine_name(text: str, lang: str) -> Optional[str]:
-    """強化抽取藥品名稱，支援品牌/加強錠/副標題合併"""
-    lines = [clean_text(l) for l in text.split('\n') if clean_text(l)]
-    keywords = MEDICINE_NAME_KEYWORDS[lang]
-    quantity_keywords = QUANTITY_KEYWORDS[lang]
-    ingredient_keywords = INGREDIENT_KEYWORDS[lang]
-    # 1. 優先找有關鍵詞的行
-    potential_lines = []
-    for line in lines:
-        for keyword in keywords:
-            if keyword in line:
-                potential_lines.append(line)
-                break
-    if potential_lines:
-        for line in potential_lines:
-            if ':' in line or '：' in line:
-                parts = re.split(r'[:：]', line, 1)
-                if len(parts) > 1 and parts[1].strip():
-                    return clean_text(parts[1].strip())
-            elif '品名' in line and len(line) > 3:
-                parts = line.split('品名', 1)
+def _single_pass_extract(text: str, lang: str) -> Tuple[Optional[str], List[str], Optional[str]]:
+    """
+    單次走訪OCR文本的每一行，同時收集藥品名稱、成分、數量的線索
+    
+    每行只做一次關鍵詞掃描與單位/劑量比對，再依類別分派：
+    - 名稱：含名稱關鍵詞的行，以及前5行非空行（交由_pick_name決定）
+    - 成分：沿用成分區段狀態機（以原始行判斷，空行結束區段）
+    - 數量：第一個含數量關鍵詞且有單位/劑量的行，否則取第一個有單位的行
+    
+    返回:
+        (藥品名稱, 成分列表, 數量)
+    """
+    dose_regex = DOSE_REGEX.get(lang, DOSE_REGEX['en'])
+    unit_regex = UNIT_REGEX.get(lang, UNIT_REGEX['en'])
+    categories_of = KEYWORD_CATEGORIES[lang]
+    raw_lines = text.split('\n')
+    
+    name_lines = []
+    first_lines = []
+    ingredients = []
+    in_ingredient_section = False
+    quantity = None
+    first_unit = None
+    
+    for raw_line in raw_lines:
+        raw_keywords = line_keywords(raw_line, lang)
+        raw_categories = set()
+        for keyword in raw_keywords:
+            raw_categories |= categories_of[keyword]
+        line = clean_text(raw_line)
+        categories = raw_categories if line == raw_line else line_categories(line, lang)
+        
+        # 成分：檢查是否進入成分區段
+        if 'ingredient' in raw_categories:
+            in_ingredient_section = True
+            # 嘗試提取冒號後的內容作為成分
+            if ':' in raw_line or '：' in raw_line:
+                parts = _COLON_REGEX.split(raw_line, 1)
                 if len(parts) > 1 and parts[1].strip():
-                    return clean_text(parts[1].strip())
+                    ingredients.append(clean_text(parts[1].strip()))
+            # 如果該行還包含數量信息，很可能是成分和含量的組合
+            elif dose_regex.search(raw_line):
+                ingredients.append(line)
+        elif in_ingredient_section:
+            # 如果是空行或者遇到其他區段關鍵詞，退出成分區段
+            if not line or any(keyword not in INGREDIENT_KEYWORDS[lang] for keyword in raw_keywords):
+                in_ingredient_section = False
+            # 否則繼續添加到成分列表（檢查行中是否包含劑量信息）
+            elif dose_regex.search(raw_line):
+                ingredients.append(line)
+        
+        if not line:
+            continue
+        
+        # 名稱：收集候選行
+        if 'name' in categories:
+            name_lines.append(line)
+        if len(first_lines) < 5:
+            first_lines.append((line, categories))
+        
+        # 數量：含關鍵詞的行優先，其次為第一個有單位的行
+        if quantity is None:
+            unit_matches = unit_regex.findall(line)
+            if 'quantity' in categories:
+                if unit_matches:
+                    quantity = unit_matches[0]
                 else:
-                    return clean_text(line)
+                    # 沒有單位，找劑量
+                    dose_matches = dose_regex.findall(line)
+                    if dose_matches:
+                        quantity = dose_matches[0]
+            if first_unit is None and unit_matches:
+                first_unit = unit_matches[0]
+    
+    # 如果沒有找到任何成分，嘗試通過劑量模式直接查找（劑量可能跨行，需比對全文）
+    if not ingredients:
+        for match in dose_regex.findall(text):
+            # 查找包含這個劑量的行
+            for raw_line in raw_lines:
+                if match in raw_line:
+                    ingredients.append(clean_text(raw_line))
+                    break
+    
+    # 移除重複項
+    return _pick_name(name_lines, first_lines, lang), list(set(ingredients)), quantity or first_unit
+
+def _pick_name(name_lines: List[str], first_lines: List[Tuple[str, Set[str]]], lang: str) -> Optional[str]:
+    """由候選行決定藥品名稱，支援品牌/加強錠/副標題合併"""
+    # 1. 優先找有關鍵詞的行
+    for line in name_lines:
+        if ':' in line or '：' in line:
+            parts = _COLON_REGEX.split(line, 1)
+            if len(parts) > 1 and parts[1].strip():
+                return clean_text(parts[1].strip())
+        elif '品名' in line and len(line) > 3:
+            parts = line.split('品名', 1)
+            if len(parts) > 1 and parts[1].strip():
+                return clean_text(parts[1].strip())
+            else:
+                return clean_text(line)
     # 2. 無關鍵詞時，前5行找「非關鍵詞、非數量、非成分」且2~8字的行
-    first_lines = lines[:min(5, len(lines))]
-    for idx, line in enumerate(first_lines):
+    for idx, (line, categories) in enumerate(first_lines):
         # 排除只含關鍵詞、數量、成分的行
         if contains_only_keywords(line, lang):
             continue
-        if any(kw in line for kw in quantity_keywords+ingredient_keywords):
+        if categories & {'quantity', 'ingredient'}:
             continue
         # 排除明顯為數量的行
-        if re.match(r'^\d+\s*(錠|粒|包|瓶|支|片|劑)$', line):
+        if _UNIT_ONLY_LINE_REGEX.match(line):
             continue
         # 字數合理
         if 2 <= len(line) <= 8:
             # 嘗試合併下一行（如加強錠、副標題）
             if idx+1 < len(first_lines):
-                next_line = first_lines[idx+1]
+                next_line = first_lines[idx+1][0]
                 if 2 <= len(next_line) <= 6 and not contains_only_keywords(next_line, lang):
                     return f"{line} {next_line}".strip()
             return line
     return None
 
-
-def extract_ingredients(text: str, lang: str) -> List[str]:
-    """抽取藥品成分"""
-    lines = text.split('\n')
-    keywords = INGREDIENT_KEYWORDS[lang]
-    ingredients = []
-    
-    in_ingredient_section = False
-    
-    for line in lines:
-        # 檢查是否進入成分區段
-        found_keyword = False
-        for keyword in keywords:
-            if keyword in line:
-                in_ingredient_section = True
-                found_keyword = True
-                # 嘗試提取冒號後的內容作為成分
-                if ':' in line or '：' in line:
-                    parts = re.split(r'[:：]', line, 1)
-                    if len(parts) > 1 and parts[1].strip():
-                        ingredients.append(clean_text(parts[1].strip()))
-                        break
-                # 如果該行還包含數量信息，很可能是成分和含量的組合
-                else:
-                    # 使用劑量模式提取
-                    dose_pattern = DOSE_PATTERNS.get(lang, DOSE_PATTERNS['en'])
-                    dose_matches = re.findall(dose_pattern, line)
-                    if dose_matches:
-                        ingredients.append(clean_text(line.strip()))
-                        break
-        if not found_keyword and in_ingredient_section:
-            # 如果是空行或者遇到其他區段關鍵詞，退出成分區段
-            if not line.strip() or contains_section_keywords(line, lang, exclude=INGREDIENT_KEYWORDS[lang]):
-                in_ingredient_section = False
-            # 否則繼續添加到成分列表
-            elif line.strip():
-                # 檢查行中是否包含劑量信息
-                dose_pattern = DOSE_PATTERNS.get(lang, DOSE_PATTERNS['en'])
-                dose_matches = re.findall(dose_pattern, line)
-                if dose_matches:
-                    ingredients.append(clean_text(line.strip()))
-    
-    # 如果沒有找到任何成分，嘗試通過劑量模式直接查找
-    if not ingredients:
-        dose_pattern = DOSE_PATTERNS.get(lang, DOSE_PATTERNS['en'])
-        dose_matches = re.findall(dose_pattern, text)
-        for match in dose_matches:
-            # 查找包含這個劑量的行
-            for line in lines:
-                if match in line:
-                    ingredients.append(clean_text(line.strip()))
-                    break
-    
-    # 移除重複項
-    return list(set(ingredients))
-
-def extract_quantity(text: str, lang: str) -> Optional[str]:
-    """強化抽取藥品數量，支援單獨一行如16錠、20粒等"""
-    lines = [clean_text(l) for l in text.split('\n') if clean_text(l)]
-    keywords = QUANTITY_KEYWORDS[lang]
-    unit_pattern = UNIT_PATTERNS.get(lang, UNIT_PATTERNS['en'])
-    # 1. 先找有關鍵詞的行
-    for line in lines:
-        for keyword in keywords:
-            if keyword in line:
-                unit_matches = re.findall(unit_pattern, line)
-                if unit_matches:
-                    return unit_matches[0]
-                # 沒有單位，找劑量
-                dose_pattern = DOSE_PATTERNS.get(lang, DOSE_PATTERNS['en'])
-                dose_matches = re.findall(dose_pattern, line)
-                if dose_matches:
-                    return dose_matches[0]
-    # 2. 直接找所有可能的單位數量（如16錠、20粒）
-    candidates = []
-    for idx, line in enumerate(lines):
-        unit_matches = re.findall(unit_pattern, line)
-        if unit_matches:
-            candidates.append((idx, unit_matches[0]))
-    if candidates:
-        # 優先取最靠近藥品名稱的那一行
-        return candidates[0][1]
-    return None
-
 def clean_text(text: str) -> str:
     """清理文本，移除多餘的空白字符"""
-    return re.sub(r'\s+', ' ', text).strip()
+    return _WHITESPACE_REGEX.sub(' ', text).strip()
 
 def contains_only_keywords(text: str, lang: str) -> bool:
     """檢查文本是否僅包含關鍵詞"""
-    all_keywords = set()
-    all_keywords.update(MEDICINE_NAME_KEYWORDS[lang])
-    all_keywords.update(INGREDIENT_KEYWORDS[lang])
-    all_keywords.update(QUANTITY_KEYWORDS[lang])
-    
-    text_lower = text.lower()
-    
-    # 檢查文本是否只包含這些關鍵詞
-    for keyword in all_keywords:
-        text_lower = text_lower.replace(keyword.lower(), '')
+    # 一次移除所有關鍵詞
+    text_lower = ALL_KEYWORD_REGEX[lang].sub('', text.lower())
     
     # 移除標點符號和空白
-    cleaned = re.sub(r'[^\w\s]', '', text_lower).strip()
+    cleaned = _PUNCTUATION_REGEX.sub('', text_lower).strip()
     
     # 如果清理後文本為空，表示原文本只包含關鍵詞
     return not cleaned
 
 def contains_section_keywords(text: str, lang: str, exclude: List[str]) -> bool:
     """檢查文本是否包含某一區段的關鍵詞（排除指定關鍵詞）"""
-    section_keywords = set()
-    section_keywords.update(MEDICINE_NAME_KEYWORDS[lang])
-    section_keywords.update(INGREDIENT_KEYWORDS[lang])
-    section_keywords.update(QUANTITY_KEYWORDS[lang])
-    
-    # 移除排除的關鍵詞
-    for kw in exclude:
-        if kw in section_keywords:
-            section_keywords.remove(kw)
-    
-    # 檢查是否包含任一區段關鍵詞
-    for keyword in section_keywords:
-        if keyword in text:
-            return True
-    
-    return False
+    return any(keyword not in exclude for keyword in line_keywords(text, lang))
 
 def calculate_confidence(name: Optional[str], ingredients: List[str], quantity: Optional[str]) -> float:
     """計算抽取結果的置信度"""
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from app.modules.ocr.ocr_engine import GCP_BATCH_SIZE, perform_ocr_batch
+
+logger = logging.getLogger(__name__)
+
+# 同時進行中的 GCP Vision 請求上限與每秒請求數上限
+GCP_MAX_INFLIGHT = int(os.environ.get("GCP_MAX_INFLIGHT", "8"))
+GCP_MAX_RPS = float(os.environ.get("GCP_MAX_RPS", "10"))
+
+class RateLimiter:
+    """
+    以固定間隔發放請求額度的限速器
+    """
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        等待直到可以送出下一個請求
+        """
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next = max(now, self._next) + self.interval
+
+_semaphore: Optional[asyncio.Semaphore] = None
+_rate_limiter: Optional[RateLimiter] = None
+
+def _get_limits() -> tuple:
+    """
+    取得共用的信號量與限速器，需在事件迴圈內建立
+    """
+    global _semaphore, _rate_limiter
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(GCP_MAX_INFLIGHT)
+        _rate_limiter = RateLimiter(GCP_MAX_RPS)
+    return _semaphore, _rate_limiter
+
+async def _limited_call(func, *args):
+    semaphore, rate_limiter = _get_limits()
+    async with semaphore:
+        await rate_limiter.acquire()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+async def ocr_batch_async(images: List[np.ndarray]) -> List[tuple[str, str]]:
+    """
+    以非同步方式批次呼叫 GCP Vision OCR，每 GCP_BATCH_SIZE 張圖像為一個請求，受並行數與每秒請求數限制
+    快取中已有結果的圖像不會送出
+    參數:
+        images: 輸入圖像列表 (numpy array)
+    返回:
+        與images順序相同的 (識別出的文字, locale 語系) 列表
+    """
+    chunks = [images[i:i + GCP_BATCH_SIZE] for i in range(0, len(images), GCP_BATCH_SIZE)]
+    results = await asyncio.gather(*(_limited_call(perform_ocr_batch, chunk, 'auto', 'gcp') for chunk in chunks))
+    return [result for chunk_results in results for result in chunk_results]
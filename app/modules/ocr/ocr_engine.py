@@ -2,12 +2,20 @@ import cv2
 import numpy as np
 import os
 import logging
+import threading
 import pytesseract
 from typing import Optional, Dict, List, Union, Tuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import io
+from cachetools import LRUCache
 from google.cloud import vision
 from google.oauth2 import service_account
+from google.api_core import exceptions as gcp_exceptions
+from google.api_core import retry as gcp_retry
+
+from app.modules.image_processing.codec import encode_jpeg
+from app.modules.image_processing.preprocess import content_digest
 
 logger = logging.getLogger(__name__)
 
@@ -25,57 +33,254 @@ SUPPORTED_LANGUAGES = {
     'ko': 'kor',         # 韓文
     'auto': 'eng+chi_tra'  # 自動模式預設使用英文+繁中
 }
+# 未知語言時使用的Tesseract語言代碼，以及自動模式模型包含的各語言
+DEFAULT_TESSERACT_LANG = SUPPORTED_LANGUAGES['auto']
+AUTO_TESSERACT_LANGS = frozenset(DEFAULT_TESSERACT_LANG.split('+'))
 
-def perform_gcp_vision_ocr(image: np.ndarray) -> tuple[str, str]:
+# 並行辨識多張圖像時，避免每個Tesseract再以OpenMP開多個執行緒而超額使用CPU（需在載入Tesseract前設定）
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# 嘗試使用tesserocr (Tesseract C-API綁定)，讓引擎與語言模型常駐於行程內
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    logger.info("未安裝tesserocr，使用pytesseract執行OCR")
+    TESSEROCR_AVAILABLE = False
+
+# 常駐的Tesseract引擎 {tesseract語言: (引擎, 鎖)}，tesserocr引擎不可同時被多個執行緒使用
+_ENGINES: Dict[str, tuple] = {}
+_ENGINES_LOCK = threading.Lock()
+
+# 嘗試使用RapidOCR (PP-OCR模型 + ONNX Runtime)，中英文辨識較Tesseract快且準確
+try:
+    from rapidocr_onnxruntime import RapidOCR
+    RAPIDOCR_AVAILABLE = True
+except ImportError:
+    logger.info("未安裝rapidocr_onnxruntime，本地OCR使用Tesseract")
+    RAPIDOCR_AVAILABLE = False
+
+# 本地OCR引擎：'rapidocr' (中英文使用RapidOCR，其餘語言使用Tesseract) 或 'tesseract'
+LOCAL_OCR_ENGINE = os.environ.get("LOCAL_OCR_ENGINE", "rapidocr").lower()
+
+def _onnxruntime_cuda_available() -> bool:
+    """檢查onnxruntime是否提供CUDAExecutionProvider（requirements只安裝CPU版，需另外安裝onnxruntime-gpu）"""
+    try:
+        import onnxruntime
+        return "CUDAExecutionProvider" in onnxruntime.get_available_providers()
+    except Exception:
+        return False
+
+ONNXRUNTIME_CUDA_AVAILABLE = RAPIDOCR_AVAILABLE and _onnxruntime_cuda_available()
+# RapidOCR是否使用CUDA：auto (預設) 依onnxruntime是否提供CUDA決定，也可用Y/N強制指定
+_RAPIDOCR_USE_CUDA = os.environ.get("RAPIDOCR_USE_CUDA", "auto").upper()
+RAPIDOCR_USE_CUDA = ONNXRUNTIME_CUDA_AVAILABLE if _RAPIDOCR_USE_CUDA == "AUTO" else _RAPIDOCR_USE_CUDA == "Y"
+# RapidOCR每次送入方向分類與文字辨識模型的文字行數，藥盒文字行多，較大的批次可減少推論次數
+RAPIDOCR_BATCH_SIZE = int(os.environ.get("RAPIDOCR_BATCH_SIZE", "16"))
+# RapidOCR預設模型涵蓋的語言
+RAPIDOCR_LANGUAGES = frozenset({'auto', 'zh-tw', 'zh-cn', 'en'})
+
+# 暖機用假圖像尺寸 (寬, 高)
+WARM_UP_IMAGE_SIZE = (800, 600)
+
+_rapidocr_engine = None
+_rapidocr_lock = threading.Lock()
+
+# 送入Tesseract前圖像長邊的上限（約300dpi）
+TESSERACT_MAX_SIDE = 1600
+
+# Tesseract參數：單欄多種字級 (PSM 4)、只用LSTM引擎 (OEM 1)、固定300dpi，並略過詞典載入
+TESSERACT_PSM = 4
+TESSERACT_OEM = 1
+TESSERACT_DPI = 300
+TESSERACT_VARIABLES = {
+    'preserve_interword_spaces': '1',
+    'load_system_dawg': '0',
+    'load_freq_dawg': '0',
+}
+TESSERACT_CONFIG = ' '.join(
+    [f'--oem {TESSERACT_OEM}', f'--psm {TESSERACT_PSM}', f'--dpi {TESSERACT_DPI}']
+    + [f'-c {name}={value}' for name, value in TESSERACT_VARIABLES.items()]
+)
+
+# 批次OCR的最大並行數 (Tesseract為外部行程，不受GIL限制)
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", os.cpu_count() or 1))
+
+# OCR結果快取 {(圖像內容雜湊, 語言, 模式): 結果}，重複上傳同一張圖像時略過OCR
+OCR_CACHE_SIZE = 512
+_ocr_cache = LRUCache(maxsize=OCR_CACHE_SIZE)
+_ocr_cache_lock = threading.Lock()
+
+def ocr_cache_key(image: np.ndarray, lang: str, mode: str) -> tuple:
+    """以圖像內容、尺寸、語言與模式組成OCR結果快取鍵"""
+    return (content_digest(np.ascontiguousarray(image).data), image.shape, image.dtype.str, lang, mode)
+
+def _get_cached_ocr(key: tuple):
+    with _ocr_cache_lock:
+        return _ocr_cache.get(key)
+
+def _store_cached_ocr(key: tuple, result) -> None:
+    # 只快取有文字的結果，GCP暫時性失敗不會被記住
+    text = result[0] if isinstance(result, tuple) else result
+    if text:
+        with _ocr_cache_lock:
+            _ocr_cache[key] = result
+
+# 常駐的GCP Vision客戶端，重複使用已建立的憑證與gRPC連線
+_GCP_CLIENT: Optional[vision.ImageAnnotatorClient] = None
+_GCP_CREDENTIALS: Optional[service_account.Credentials] = None
+_GCP_CLIENT_LOCK = threading.Lock()
+# 單次 BatchAnnotateImages 請求可包含的圖像數上限
+GCP_BATCH_SIZE = 16
+# 上傳至 GCP Vision 的JPEG品質，以及改用PNG上傳的像素數門檻
+GCP_JPEG_QUALITY = 90
+GCP_PNG_MAX_PIXELS = 160 * 160
+# 遇到配額或服務暫時不可用時以指數退避重試 GCP 請求
+GCP_RETRY = gcp_retry.Retry(
+    predicate=gcp_retry.if_exception_type(gcp_exceptions.ResourceExhausted, gcp_exceptions.ServiceUnavailable),
+    initial=1.0,
+    maximum=16.0,
+    multiplier=2.0,
+    deadline=60.0,
+)
+
+def _get_vision_client() -> Optional[vision.ImageAnnotatorClient]:
     """
-    使用 Google Cloud Vision API 執行 OCR
+    取得常駐的GCP Vision客戶端，首次呼叫時才讀取憑證並建立連線
+    返回:
+        ImageAnnotatorClient，找不到憑證時返回None
+    """
+    global _GCP_CLIENT, _GCP_CREDENTIALS
+    if _GCP_CLIENT is not None:
+        return _GCP_CLIENT
+    with _GCP_CLIENT_LOCK:
+        if _GCP_CLIENT is None:
+            # 檢查憑證路徑
+            cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+            if not cred_path or not os.path.exists(cred_path):
+                logger.error("找不到 GCP 憑證檔案，請設置 GOOGLE_APPLICATION_CREDENTIALS")
+                return None
+            if _GCP_CREDENTIALS is None:
+                _GCP_CREDENTIALS = service_account.Credentials.from_service_account_file(cred_path)
+            _GCP_CLIENT = vision.ImageAnnotatorClient(credentials=_GCP_CREDENTIALS)
+            logger.info("已建立 GCP Vision 客戶端")
+    return _GCP_CLIENT
+
+def _encode_gcp_image(image: np.ndarray) -> Optional[bytes]:
+    """
+    將圖像編碼為上傳至 GCP Vision 的位元組
     參數:
         image: 輸入圖像 (numpy array)
     返回:
-        (識別出的文字, locale 語系)
+        編碼後的 bytes，失敗時返回None
     """
-    try:
-        # 將 numpy array 轉為 PNG bytes
+    # 照片以JPEG上傳，編碼較PNG快且檔案小；帶alpha通道或極小的區域改用PNG以免壓縮失真
+    if image.ndim == 3 and image.shape[2] == 4 or image.shape[0] * image.shape[1] < GCP_PNG_MAX_PIXELS:
         is_success, buffer = cv2.imencode(".png", image)
         if not is_success:
             logger.error("無法將圖像編碼為 PNG 格式")
-            return "", "en"
-
+            return None
         content = buffer.tobytes()
+    else:
+        try:
+            content = encode_jpeg(image, quality=GCP_JPEG_QUALITY)
+        except ValueError as e:
+            logger.error(str(e))
+            return None
+    logger.debug(f"GCP 上傳圖像大小: {len(content)} bytes")
+    return content
+
+def _parse_gcp_response(response) -> tuple[str, str]:
+    """
+    解析 GCP Vision 的文字偵測回應
+    參數:
+        response: AnnotateImageResponse
+    返回:
+        (識別出的文字, locale 語系)
+    """
+    # 原始回應與逐區塊內容只在DEBUG層級記錄（protobuf轉字串的成本與文字量成正比）
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f"GCP 回應 JSON:\n{response}")
+
+    texts = response.text_annotations
+    if texts:
+        locale = getattr(texts[0], "locale", None) or "en"
+        logger.info(f"GCP Vision OCR 識別成功，共 {len(texts)} 區塊")
+        if debug:
+            logger.debug("辨識文字區塊詳細內容：")
+            for i, t in enumerate(texts):
+                logger.debug(
+                    f"[{i}] {t.description.strip()} (conf={t.confidence if hasattr(t, 'confidence') else 'N/A'})")
+        return texts[0].description, locale
+    else:
+        logger.warning("GCP Vision OCR 無識別結果")
+        return "", "en"
 
-        # 檢查憑證路徑
-        cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-        if not cred_path or not os.path.exists(cred_path):
-            logger.error("找不到 GCP 憑證檔案，請設置 GOOGLE_APPLICATION_CREDENTIALS")
+def perform_gcp_vision_ocr(image: np.ndarray) -> tuple[str, str]:
+    """
+    使用 Google Cloud Vision API 執行 OCR
+    參數:
+        image: 輸入圖像 (numpy array)
+    返回:
+        (識別出的文字, locale 語系)
+    """
+    try:
+        content = _encode_gcp_image(image)
+        if content is None:
             return "", "en"
 
-        # 建立 GCP 客戶端
-        credentials = service_account.Credentials.from_service_account_file(cred_path)
-        client = vision.ImageAnnotatorClient(credentials=credentials)
+        client = _get_vision_client()
+        if client is None:
+            return "", "en"
 
         # 建立圖片物件
         image_gcp = vision.Image(content=content)
-        response = client.text_detection(image=image_gcp)
-
-        # ✅ 全部記錄 GCP 原始回應內容（可選，開發用）
-        logger.info("GCP 回應 JSON:\n" + str(response))
-
-        texts = response.text_annotations
-        if texts:
-            locale = getattr(texts[0], "locale", None) or "en"
-            logger.info(f"GCP Vision OCR 識別成功，共 {len(texts)} 區塊")
-            logger.info("辨識文字區塊詳細內容：")
-            for i, t in enumerate(texts):
-                logger.info(
-                    f"[{i}] {t.description.strip()} (conf={t.confidence if hasattr(t, 'confidence') else 'N/A'})")
-            return texts[0].description, locale
-        else:
-            logger.warning("GCP Vision OCR 無識別結果")
-            return "", "en"
+        response = client.text_detection(image=image_gcp, retry=GCP_RETRY)
+        return _parse_gcp_response(response)
     except Exception as e:
         logger.error(f"GCP Vision OCR 處理失敗: {str(e)}")
         return "", "en"
 
+def perform_gcp_vision_ocr_batch(images: List[np.ndarray]) -> List[tuple[str, str]]:
+    """
+    使用 Google Cloud Vision API 批次執行 OCR，每次請求最多打包 GCP_BATCH_SIZE 張圖像
+    參數:
+        images: 輸入圖像列表 (numpy array)
+    返回:
+        與images順序相同的 (識別出的文字, locale 語系) 列表
+    """
+    results = [("", "en")] * len(images)
+    if not images:
+        return results
+    client = _get_vision_client()
+    if client is None:
+        return results
+
+    # 編碼時OpenCV會釋放GIL，可並行處理
+    with ThreadPoolExecutor(max_workers=min(len(images), OCR_MAX_WORKERS)) as executor:
+        encoded = list(executor.map(_encode_gcp_image, images))
+    pending = [(i, content) for i, content in enumerate(encoded) if content is not None]
+    feature = vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)
+
+    for start in range(0, len(pending), GCP_BATCH_SIZE):
+        chunk = pending[start:start + GCP_BATCH_SIZE]
+        requests = [
+            vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+            for _, content in chunk
+        ]
+        try:
+            batch_response = client.batch_annotate_images(requests=requests, retry=GCP_RETRY)
+        except Exception as e:
+            logger.error(f"GCP Vision 批次 OCR 處理失敗: {str(e)}")
+            continue
+        for (i, _), response in zip(chunk, batch_response.responses):
+            if response.error.message:
+                logger.error(f"GCP Vision OCR 處理失敗: {response.error.message}")
+                continue
+            results[i] = _parse_gcp_response(response)
+    return results
+
 
 def perform_ocr(image: np.ndarray, lang: str = 'auto', mode: str = 'local') -> Union[str, tuple[str, str]]:
     """
@@ -87,17 +292,217 @@ def perform_ocr(image: np.ndarray, lang: str = 'auto', mode: str = 'local') -> U
     返回:
         識別出的文字 或 (文字, locale)
     """
-    if mode == 'gcp':
-        return perform_gcp_vision_ocr(image)
+    if mode != 'gcp':
+        return perform_local_ocr(image, lang)[0]
+    key = ocr_cache_key(image, 'auto', mode)
+    cached = _get_cached_ocr(key)
+    if cached is not None:
+        logger.info("使用快取的OCR結果")
+        return cached
+
+    result = perform_gcp_vision_ocr(image)
+    _store_cached_ocr(key, result)
+    return result
+
+def perform_local_ocr(image: np.ndarray, lang: str = 'auto') -> Tuple[str, str]:
+    """
+    以本地引擎執行OCR處理（RapidOCR失敗或不支援該語言時改用Tesseract）
+    參數:
+        image: 輸入圖像 (numpy array)
+        lang: 語言代碼 ('zh-tw', 'zh-cn', 'en', 'ja', 'ko', 'auto')
+    返回:
+        (識別出的文字, 實際使用的引擎 'rapidocr' 或 'tesseract')
+    """
     if lang not in SUPPORTED_LANGUAGES:
         logger.warning(f"不支援的語言: {lang}，使用預設語言: auto")
         lang = 'auto'
-    return perform_tesseract_ocr(image, lang)
+    key = ocr_cache_key(image, lang, 'local')
+    cached = _get_cached_ocr(key)
+    if cached is not None:
+        logger.info("使用快取的OCR結果")
+        return cached
+
+    text = perform_rapidocr_ocr(image) if use_rapidocr(lang) else None
+    if text is not None:
+        result = (text, 'rapidocr')
+    else:
+        result = (perform_tesseract_ocr(image, lang), 'tesseract')
+    _store_cached_ocr(key, result)
+    return result
+
+def use_rapidocr(lang: str) -> bool:
+    """檢查該語言是否由RapidOCR辨識"""
+    return RAPIDOCR_AVAILABLE and LOCAL_OCR_ENGINE == 'rapidocr' and lang in RAPIDOCR_LANGUAGES
+
+def _get_rapidocr_engine():
+    """取得常駐的RapidOCR引擎，首次使用時才載入模型"""
+    global _rapidocr_engine
+    if _rapidocr_engine is None:
+        with _rapidocr_lock:
+            if _rapidocr_engine is None:
+                logger.info(f"載入RapidOCR引擎 (CUDA: {RAPIDOCR_USE_CUDA})")
+                _rapidocr_engine = RapidOCR(
+                    det_use_cuda=RAPIDOCR_USE_CUDA,
+                    cls_use_cuda=RAPIDOCR_USE_CUDA,
+                    rec_use_cuda=RAPIDOCR_USE_CUDA,
+                    cls_batch_num=RAPIDOCR_BATCH_SIZE,
+                    rec_batch_num=RAPIDOCR_BATCH_SIZE
+                )
+    return _rapidocr_engine
+
+def perform_rapidocr_ocr(image: np.ndarray) -> Optional[str]:
+    """
+    使用RapidOCR執行文字偵測與辨識
+    
+    參數:
+        image: 輸入圖像 (numpy array)
+        
+    返回:
+        識別出的文字（依偵測順序逐行合併），失敗時返回None以改用Tesseract
+    """
+    try:
+        result, _ = _get_rapidocr_engine()(image)
+        text = "\n".join(line[1] for line in result) if result else ""
+        logger.info(f"RapidOCR識別成功，共 {len(result) if result else 0} 行")
+        return text
+    except Exception as e:
+        logger.warning(f"RapidOCR處理失敗，改用Tesseract: {str(e)}")
+        return None
+
+def lang_matches_auto_model(lang: str, auto_engine: str) -> bool:
+    """
+    檢查自動模式的初步OCR是否已使用該語言的模型
+    
+    參數:
+        lang: 語言代碼
+        auto_engine: 實際執行初步OCR的引擎 ('rapidocr' 或 'tesseract')
+        
+    返回:
+        自動模式的初步OCR已使用該語言模型時返回True
+    """
+    if auto_engine == 'rapidocr':
+        # 初步OCR與精確OCR都由同一個RapidOCR模型辨識
+        return use_rapidocr(lang)
+    tesseract_lang = SUPPORTED_LANGUAGES.get(lang)
+    return tesseract_lang is not None and tesseract_lang in AUTO_TESSERACT_LANGS
+
+def perform_ocr_batch(
+    images: List[np.ndarray],
+    lang: Union[str, List[str]] = 'auto',
+    mode: str = 'local'
+) -> List[Union[str, tuple[str, str]]]:
+    """
+    對多張圖像批次執行OCR處理
+    參數:
+        images: 輸入圖像列表 (numpy array)
+        lang: 語言代碼，或與images等長的語言代碼列表
+        mode: 'local' 或 'gcp'
+    返回:
+        與images順序相同的識別結果列表
+    """
+    if not images:
+        return []
+    langs = [lang] * len(images) if isinstance(lang, str) else list(lang)
+    if len(langs) != len(images):
+        raise ValueError("語言代碼數量與圖像數量不一致")
+    if mode == 'gcp':
+        keys = [ocr_cache_key(image, 'auto', mode) for image in images]
+        results = [_get_cached_ocr(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(misses, perform_gcp_vision_ocr_batch([images[i] for i in misses])):
+            _store_cached_ocr(keys[i], result)
+            results[i] = result
+        return results
+    # 圖像層級的並行由呼叫端的工作行程池負責，這裡逐張辨識
+    return [perform_ocr(image, image_lang, mode) for image, image_lang in zip(images, langs)]
+
+def _get_tesseract_engine(tesseract_lang: str) -> tuple:
+    """
+    取得指定語言的常駐Tesseract引擎，首次使用時才建立
+    
+    參數:
+        tesseract_lang: Tesseract語言代碼 (如 'eng+chi_tra')
+        
+    返回:
+        (tesserocr.PyTessBaseAPI, threading.Lock)
+    """
+    engine = _ENGINES.get(tesseract_lang)
+    if engine is None:
+        with _ENGINES_LOCK:
+            engine = _ENGINES.get(tesseract_lang)
+            if engine is None:
+                logger.info(f"建立常駐Tesseract引擎，語言: {tesseract_lang}")
+                api = tesserocr.PyTessBaseAPI(
+                    lang=tesseract_lang,
+                    psm=TESSERACT_PSM,
+                    oem=TESSERACT_OEM,
+                    variables=dict(TESSERACT_VARIABLES, user_defined_dpi=str(TESSERACT_DPI))
+                )
+                engine = _ENGINES[tesseract_lang] = (api, threading.Lock())
+    return engine
+
+def warm_up_ocr(langs: Tuple[str, ...] = ('auto',)) -> None:
+    """
+    預先載入常駐OCR引擎（RapidOCR或Tesseract），讓第一個請求不必等待模型載入
+    
+    參數:
+        langs: 要預先載入的語言代碼
+    """
+    for lang in langs:
+        try:
+            if use_rapidocr(lang):
+                engine = _get_rapidocr_engine()
+                if RAPIDOCR_USE_CUDA and ONNXRUNTIME_CUDA_AVAILABLE:
+                    # 實際以CUDA推論時首次推論需配置記憶體並挑選cuDNN演算法，先以假圖像跑過偵測、分類與辨識；
+                    # CPU推論沒有這項成本，不必讓每個工作行程啟動時多跑一次完整推論
+                    engine(_warm_up_image())
+            elif TESSEROCR_AVAILABLE:
+                _get_tesseract_engine(SUPPORTED_LANGUAGES.get(lang, DEFAULT_TESSERACT_LANG))
+        except Exception as e:
+            logger.warning(f"預先載入OCR引擎失敗 ({lang}): {str(e)}")
+
+def _warm_up_image() -> np.ndarray:
+    """產生含文字的假圖像，讓暖機推論經過完整的偵測與辨識流程"""
+    image = np.full((WARM_UP_IMAGE_SIZE[1], WARM_UP_IMAGE_SIZE[0], 3), 255, dtype=np.uint8)
+    cv2.putText(image, "PILLBOX OCR 500mg", (40, WARM_UP_IMAGE_SIZE[1] // 2),
+                cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 3)
+    return image
+
+def prepare_tesseract_input(image: np.ndarray) -> np.ndarray:
+    """
+    轉為灰度並將長邊縮至TESSERACT_MAX_SIDE以內（Tesseract內部本就以灰度辨識，約300dpi效果最佳）
+    
+    參數:
+        image: 輸入圖像 (numpy array)
+        
+    返回:
+        灰度圖像 (numpy array)
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = TESSERACT_MAX_SIDE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+def _tesserocr_image_to_string(image: np.ndarray, tesseract_lang: str) -> str:
+    """使用常駐的tesserocr引擎識別文字（直接傳入像素緩衝區，不經PIL轉換）"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    api, lock = _get_tesseract_engine(tesseract_lang)
+    with lock:
+        api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width * bytes_per_pixel)
+        return api.GetUTF8Text()
 
 def perform_tesseract_ocr(image: np.ndarray, lang: str) -> str:
     """
     使用Tesseract執行OCR處理
     
+    優先使用常駐的tesserocr引擎，無法使用時改以pytesseract呼叫tesseract執行檔
+    
     參數:
         image: 輸入圖像 (numpy array)
         lang: 語言代碼
@@ -107,15 +512,23 @@ def perform_tesseract_ocr(image: np.ndarray, lang: str) -> str:
     """
     try:
         # 轉換語言代碼到Tesseract格式
-        tesseract_lang = SUPPORTED_LANGUAGES.get(lang, 'eng+chi_tra')
+        tesseract_lang = SUPPORTED_LANGUAGES.get(lang, DEFAULT_TESSERACT_LANG)
+        image = prepare_tesseract_input(image)
         # 文字識別
+        if TESSEROCR_AVAILABLE:
+            try:
+                text = _tesserocr_image_to_string(image, tesseract_lang)
+                logger.info(f"Tesseract OCR識別成功，使用語言: {tesseract_lang}")
+                return text
+            except Exception as e:
+                logger.warning(f"tesserocr識別失敗，改用pytesseract: {str(e)}")
         text = pytesseract.image_to_string(
             image,
             lang=tesseract_lang,
-            config='--psm 6'  # 假設頁面為單一文本塊
+            config=TESSERACT_CONFIG
         )
         logger.info(f"Tesseract OCR識別成功，使用語言: {tesseract_lang}")
         return text
     except Exception as e:
         logger.error(f"Tesseract OCR處理失敗: {str(e)}")
-        return "" 
\ No newline at end of file
+        return ""
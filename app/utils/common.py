@@ -9,9 +9,19 @@ import datetime
 
 logger = logging.getLogger(__name__)
 
+# 嘗試使用orjson (C實作) 進行JSON序列化，未安裝時使用標準庫json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 有效的圖像副檔名
+VALID_IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'})
+
 def generate_unique_id() -> str:
     """生成唯一的ID"""
-    return str(uuid.uuid4())
+    return uuid.uuid4().hex
 
 def ensure_directory_exists(directory_path: Union[str, Path]) -> None:
     """確保目錄存在，如果不存在則創建"""
@@ -21,8 +31,12 @@ def ensure_directory_exists(directory_path: Union[str, Path]) -> None:
 def save_json(data: Dict[str, Any], file_path: Union[str, Path]) -> bool:
     """將字典保存為JSON文件"""
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        if ORJSON_AVAILABLE:
+            with open(file_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
         return True
     except Exception as e:
         logger.error(f"保存JSON文件失敗: {str(e)}")
@@ -31,15 +45,42 @@ def save_json(data: Dict[str, Any], file_path: Union[str, Path]) -> bool:
 def load_json(file_path: Union[str, Path]) -> Optional[Dict[str, Any]]:
     """載入JSON文件為字典"""
     try:
+        if ORJSON_AVAILABLE:
+            return orjson.loads(Path(file_path).read_bytes())
         with open(file_path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
         logger.error(f"載入JSON文件失敗: {str(e)}")
         return None
 
+def _iter_files(directory: Union[str, Path]):
+    """遞迴列出目錄下的所有檔案（DirEntry會快取stat結果，不另外建立Path物件）"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+def _remove_empty_dirs(directory: Union[str, Path], threshold: float) -> None:
+    """
+    由下而上刪除目錄下已清空、且修改時間早於threshold的子目錄（不刪除directory本身）
+
+    剛建立、尚未寫入檔案的目錄修改時間較新，不會被刪除
+    """
+    with os.scandir(directory) as entries:
+        subdirs = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+    for subdir in subdirs:
+        _remove_empty_dirs(subdir, threshold)
+        try:
+            if os.stat(subdir).st_mtime < threshold:
+                os.rmdir(subdir)
+        except OSError:
+            pass
+
 def cleanup_old_files(directory: Union[str, Path], days: int = 7) -> int:
     """
-    清理指定目錄中超過指定天數的文件
+    清理指定目錄中超過指定天數的文件，並刪除清空後的子目錄
     
     參數:
         directory: 要清理的目錄
@@ -49,27 +90,25 @@ def cleanup_old_files(directory: Union[str, Path], days: int = 7) -> int:
         刪除的文件數量
     """
     try:
-        directory_path = Path(directory)
-        if not directory_path.exists() or not directory_path.is_dir():
+        if not os.path.isdir(directory):
             logger.warning(f"目錄不存在或不是有效的目錄: {directory}")
             return 0
             
         now = datetime.datetime.now()
-        threshold = now - datetime.timedelta(days=days)
+        threshold = (now - datetime.timedelta(days=days)).timestamp()
         
         deleted_count = 0
         
-        for item in directory_path.glob("**/*"):
-            if not item.is_file():
+        for entry in _iter_files(directory):
+            # 如果文件修改時間比閾值還舊，則刪除
+            # 檔案可能同時被處理流程刪除，已不存在時略過
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime < threshold:
+                    os.unlink(entry.path)
+                    deleted_count += 1
+            except FileNotFoundError:
                 continue
-                
-            # 獲取文件修改時間
-            mtime = datetime.datetime.fromtimestamp(item.stat().st_mtime)
-            
-            # 如果文件比閾值還舊，則刪除
-            if mtime < threshold:
-                item.unlink()
-                deleted_count += 1
+        _remove_empty_dirs(directory, threshold)
                 
         logger.info(f"清理了 {deleted_count} 個超過 {days} 天的檔案，目錄: {directory}")
         return deleted_count
@@ -84,5 +123,4 @@ def get_file_extension(filename: str) -> str:
 
 def is_valid_image_extension(extension: str) -> bool:
     """檢查是否為有效的圖像副檔名"""
-    valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp']
-    return extension.lower() in valid_extensions 
\ No newline at end of file
+    return extension.lower() in VALID_IMAGE_EXTENSIONS 
\ No newline at end of file
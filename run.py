@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 import argparse
+import importlib.util
 import subprocess
 import time
 import signal
@@ -10,21 +11,59 @@ from pathlib import Path
 # 確保上傳目錄存在
 Path("uploads").mkdir(exist_ok=True)
 
-def run_api_server(port):
+# 正式模式預設的API工作行程數（每個工作行程都會各自載入YOLO與OCR模型，GPU記憶體有限時不宜過多）
+DEFAULT_PROD_WORKERS = 2
+
+def _has_module(name):
+    """檢查可選的模組是否已安裝"""
+    return importlib.util.find_spec(name) is not None
+
+def api_server_command(port, prod=False, workers=None):
+    """
+    API伺服器的啟動命令與環境變數
+    
+    開發模式使用--reload監看檔案變更（只能單一工作行程）；
+    正式模式改以多個工作行程，並在有安裝時使用uvloop與httptools降低每個請求的事件迴圈開銷
+    """
+    cmd = ["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", str(port)]
+    env = {**os.environ, "PORT": str(port)}
+    if prod:
+        workers = workers or DEFAULT_PROD_WORKERS
+        cmd += ["--workers", str(workers), "--no-use-colors"]
+        # uvloop不支援Windows，requirements中也排除了win32
+        if sys.platform != "win32" and _has_module("uvloop"):
+            cmd += ["--loop", "uvloop"]
+        if _has_module("httptools"):
+            cmd += ["--http", "httptools"]
+        # 每個uvicorn工作行程各有一個OCR行程池，平分CPU避免行程數超額
+        env.setdefault("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+    else:
+        cmd += ["--reload"]
+    return cmd, env
+
+def frontend_command(port, api_port):
+    """Streamlit前端的啟動命令與環境變數"""
+    return (
+        ["streamlit", "run", "app/frontend/app.py", "--server.port", str(port)],
+        {**os.environ, "API_URL": f"http://localhost:{api_port}/api"}
+    )
+
+def run_api_server(port, prod=False, workers=None):
     """啟動API伺服器"""
     print(f"啟動API伺服器於 http://localhost:{port}")
-    return subprocess.Popen(
-        ["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", str(port), "--reload"],
-        env={**os.environ, "PORT": str(port)}
-    )
+    cmd, env = api_server_command(port, prod, workers)
+    return subprocess.Popen(cmd, env=env)
 
 def run_frontend(port, api_port):
     """啟動Streamlit前端"""
     print(f"啟動Streamlit前端於 http://localhost:{port}")
-    return subprocess.Popen(
-        ["streamlit", "run", "app/frontend/app.py", "--server.port", str(port)],
-        env={**os.environ, "API_URL": f"http://localhost:{api_port}/api"}
-    )
+    cmd, env = frontend_command(port, api_port)
+    return subprocess.Popen(cmd, env=env)
+
+def exec_service(cmd, env):
+    """以目標程式取代目前的Python行程（不多一層父行程，信號直接送達服務）"""
+    sys.stdout.flush()
+    os.execvpe(cmd[0], cmd, env)
 
 def handle_signal(signum, frame):
     """處理終止信號"""
@@ -42,9 +81,19 @@ if __name__ == "__main__":
     parser.add_argument("--frontend-port", type=int, default=8501, help="Streamlit前端端口")
     parser.add_argument("--api-only", action="store_true", help="只啟動API伺服器")
     parser.add_argument("--frontend-only", action="store_true", help="只啟動前端")
+    parser.add_argument("--prod", action="store_true", help="正式模式：多工作行程且不監看檔案變更")
+    parser.add_argument("--workers", type=int, default=None, help=f"正式模式的API工作行程數（預設為{DEFAULT_PROD_WORKERS}）")
     
     args = parser.parse_args()
     
+    # 只啟動單一服務時直接以該服務取代目前行程
+    if args.api_only:
+        print(f"啟動API伺服器於 http://localhost:{args.api_port}")
+        exec_service(*api_server_command(args.api_port, args.prod, args.workers))
+    if args.frontend_only:
+        print(f"啟動Streamlit前端於 http://localhost:{args.frontend_port}")
+        exec_service(*frontend_command(args.frontend_port, args.api_port))
+    
     # 註冊信號處理
     signal.signal(signal.SIGINT, handle_signal)
     signal.signal(signal.SIGTERM, handle_signal)
@@ -55,7 +104,7 @@ if __name__ == "__main__":
     
     try:
         if not args.frontend_only:
-            api_process = run_api_server(args.api_port)
+            api_process = run_api_server(args.api_port, args.prod, args.workers)
             
         if not args.api_only:
             # 等待API伺服器啟動